@@ -4,16 +4,18 @@
 
 import time
 import datetime
+import collections
 import random
-import itertools
+import functools
 from operator import itemgetter
 from heapq import *
 
 #from anki.cards import Card
-from anki.utils import ids2str, intTime, fmtTimeSpan
+from anki.utils import ids2str, chunkedIds, intTime, fmtTimeSpan
 from anki.lang import _
 from anki.consts import *
 from anki.hooks import runHook
+from anki.db import DBError, sqlite
 
 # it uses the following elements from anki.consts
 # card types: 0=new, 1=lrn, 2=rev, 3=relrn
@@ -23,6 +25,42 @@ from anki.hooks import runHook
 # positive revlog intervals are in days (rev), negative in seconds (lrn)
 # odue/odid store original due/did when cards moved to filtered deck
 
+_revlogInsert = "insert into revlog values (?,?,?,?,?,?,?,?,?)"
+_todayKeys = ("newToday", "revToday", "lrnToday", "timeToday")
+# update ... returning needs sqlite 3.35
+_haveReturning = sqlite.sqlite_version_info >= (3, 35, 0)
+
+def withConfCache(answerCard):
+    """Decorator for answerCard and nextIvl: while the card is being
+    answered, the confs computed by methods decorated with memoizedConf
+    are kept on the card, as several steps of an answer need the same
+    conf. A call nested in another one uses the outer cache."""
+    @functools.wraps(answerCard)
+    def wrapper(self, card, ease):
+        if getattr(card, "_confCache", None) is not None:
+            return answerCard(self, card, ease)
+        card._confCache = {}
+        try:
+            return answerCard(self, card, ease)
+        finally:
+            card._confCache = None
+    return wrapper
+
+def memoizedConf(confFn):
+    """Decorator for the scheduler's conf and deck lookups; see
+    withConfCache. The deck and original deck are part of the key, as answering may move
+    the card out of a filtered deck."""
+    @functools.wraps(confFn)
+    def wrapper(self, card):
+        cache = getattr(card, "_confCache", None)
+        if cache is None:
+            return confFn(self, card)
+        key = (confFn.__name__, card.did, card.odid)
+        if key not in cache:
+            cache[key] = confFn(self, card)
+        return cache[key]
+    return wrapper
+
 class BothScheduler:
     """
     today -- difference between the last time scheduler is seen and creation of the collection.
@@ -31,7 +69,7 @@ class BothScheduler:
     lrnCount --  The number of cards in learning in selected decks
     revCount -- number of cards to review today in selected decks
     newCount -- number of new cards to see today in selected decks
-    _lrnDids, _revDids, _newDids -- a copy of the set of active decks where decks with no card to see today are removed.
+    _lrnDids, _revDids, _newDids -- a deque copy of the set of active decks where decks with no card to see today are removed.
     _newQueue, _lrnQueue, _revQueue -- list of ids of cards in the queue new, lrn and rev. At most queue limit (i.e. 50)
     queueLimit -- maximum number of cards to queue simultaneously. Always 50 unless changed by an addon.
     _lrnDayQueue -- todo
@@ -49,6 +87,8 @@ class BothScheduler:
         self.reps = 0
         self.today = None
         self._haveQueues = False
+        self._deckLimitCache = (None, None)
+        self._refreshLimitFlag()
         self._updateCutoff()
 
     def getCard(self):
@@ -73,12 +113,22 @@ class BothScheduler:
 
         sync -- whether we need to compute as in original anki, for synchronization to succeed.
         """
-        self._updateCutoff()
-        self._resetLrn()
-        self._resetRev(sync=sync)
-        self._resetNew(sync=sync)
+        self._refreshLimitFlag()
+        with self.col.db.transaction():
+            self._updateCutoff()
+            self._resetLrn()
+            self._resetRev(sync=sync)
+            self._resetNew(sync=sync)
         self._haveQueues = True
 
+    def _refreshLimitFlag(self):
+        """Read the profile's limitAllCards option once, rather than in
+        each deck limit computation. The preferences reset the
+        scheduler when it is changed."""
+        from aqt import mw
+        self._limitAllCards = bool(
+            mw and mw.pm.profile.get("limitAllCards", False))
+
     def dueForecast(self, days=7):
         "Return counts over next DAYS. Includes today."
         daysd = dict(self.col.db.all(f"""
@@ -109,12 +159,17 @@ order by due""" % (self._deckLimit()),
         to this decks and all of its ancestors.
         """
         key = type+"Today"
-        for deck in ([self.col.decks.get(card.did)] +
-                  self.col.decks.parents(card.did)):
+        for deck in self._deckAndParents(card):
             # add
             deck[key][1] += cnt
             self.col.decks.save(deck)
 
+    @memoizedConf
+    def _deckAndParents(self, card):
+        """The card's deck followed by its ancestors. Answering updates
+        the stats of those decks several times."""
+        return [self.col.decks.get(card.did)] + self.col.decks.parents(card.did)
+
     def extendLimits(self, new, rev):
         """Decrease the limit of new/rev card to see today to this deck, its
         ancestors and all of its descendant, by new/rev.
@@ -185,6 +240,42 @@ order by due""" % (self._deckLimit()),
         # then run main function
         return self._groupChildrenMain(grps)
 
+    def _groupChildrenMain(self, grps):
+        """
+        [subdeck name without parent parts,
+        did, rev, lrn, new (counting subdecks)
+        [recursively the same things for the children]]
+
+        keyword arguments:
+        grps -- [[subdeck], did, rev, lrn, new] sorted according to the list subdeck.
+
+        The tree is built in a single pass over grps: stack holds the
+        deck being built at each depth, and a deck is completed by
+        _groupChildrenNode as soon as the walk leaves its subtree."""
+        tree = []
+        # [head, did, rev, lrn, new, children] of the current deck's ancestors
+        stack = []
+        heads = []
+        def close():
+            head, did, rev, lrn, new, children = stack.pop()
+            heads.pop()
+            node = self._groupChildrenNode(head, did, rev, lrn, new, tuple(children))
+            (stack[-1][5] if stack else tree).append(node)
+        for path, did, rev, lrn, new in grps:
+            # leave the decks which are not ancestors of this one
+            while stack and (len(stack) >= len(path) or
+                             heads != path[:len(stack)]):
+                close()
+            # a missing ancestor gets a node without a deck
+            while len(stack) < len(path) - 1:
+                heads.append(path[len(stack)])
+                stack.append([heads[-1], None, 0, 0, 0, []])
+            heads.append(path[-1])
+            stack.append([path[-1], did, rev, lrn, new, []])
+        while stack:
+            close()
+        return tuple(tree)
+
     # New cards
     ##########################################################################
 
@@ -193,12 +284,10 @@ order by due""" % (self._deckLimit()),
         Set newCount to the counter of new cards for the active decks.
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
         """
+        newCounts = self._newCountsForDecks(self.col.decks.active())
         # Number of card in deck did, at most lim
         def cntFn(did, lim):
-            ret = self.col.db.scalar(f"""
-select count() from (select 1 from cards where
-did = ? and queue = {QUEUE_NEW_CRAM} limit ?)""", did, lim)
-            return ret
+            return min(newCounts.get(did, 0), lim)
         self.newCount = self._walkingCount(lambda deck:self._deckNewLimitSingle(deck, sync=sync), cntFn)
 
     def _resetNew(self, sync=False):
@@ -207,7 +296,7 @@ did = ? and queue = {QUEUE_NEW_CRAM} limit ?)""", did, lim)
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
         """
         self._resetNewCount(sync=sync)
-        self._newDids = self.col.decks.active()[:]
+        self._newDids = collections.deque(self.col.decks.active())
         self._newQueue = []
         self._updateNewCardRatio()
 
@@ -231,7 +320,7 @@ did = ? and queue = {QUEUE_NEW_CRAM} limit ?)""", did, lim)
                     self._newQueue.reverse()
                     return True
             # nothing left in the deck; move to next
-            self._newDids.pop(0)
+            self._newDids.popleft()
         if self.newCount:
             # if we didn't get a card but the count is non-zero,
             # we need to check again for any cards that were
@@ -295,6 +384,15 @@ did = ? and queue = {QUEUE_NEW_CRAM} limit ?)""", did, lim)
 select count() from
 (select 1 from cards where did = ? and queue = {QUEUE_NEW_CRAM} limit ?)""", did, lim)
 
+    def _newCountsForDecks(self, dids):
+        """Map each deck of dids having new cards to the number of those
+        cards (its subdecks' cards not included).
+
+        One grouped query instead of one query per deck."""
+        return dict(self.col.db.all(f"""
+select did, count() from cards where did in %s and queue = {QUEUE_NEW_CRAM}
+group by did""" % ids2str(dids)))
+
     def totalNewForCurrentDeck(self):
         return self.col.db.scalar(
             f"""
@@ -310,7 +408,7 @@ select id from cards where did in %s and queue = {QUEUE_NEW_CRAM} limit ?)"""
         self._resetLrnCount()
         self._lrnQueue = []
         self._lrnDayQueue = []
-        self._lrnDids = self.col.decks.active()[:]
+        self._lrnDids = collections.deque(self.col.decks.active())
 
     # sub-day learning
     def _fillLrn(self, cutoff, queueIn):
@@ -322,8 +420,9 @@ select id from cards where did in %s and queue = {QUEUE_NEW_CRAM} limit ?)"""
 select due, id from cards where
 did in %s and queue in {queueIn} and due < :lim
 limit %d""" % (self._deckLimit(), self.reportLimit), lim=self.dayCutoff)
-        # as it arrives sorted by did first, we need to sort it
-        self._lrnQueue.sort()
+        # as it arrives sorted by did first, we need to order it; callers
+        # only ever peek at and pop the head, so a heap is enough
+        heapify(self._lrnQueue)
         return self._lrnQueue
 
     # daily learning
@@ -346,10 +445,10 @@ did = ? and queue = {QUEUE_DAY_LRN} and due <= ? limit ?""",
                 r.shuffle(self._lrnDayQueue)
                 # is the current did empty?
                 if len(self._lrnDayQueue) < self.queueLimit:
-                    self._lrnDids.pop(0)
+                    self._lrnDids.popleft()
                 return True
             # nothing left in the deck; move to next
-            self._lrnDids.pop(0)
+            self._lrnDids.popleft()
 
     def _getLrnDayCard(self):
         if self._fillLrnDay():
@@ -368,11 +467,11 @@ did = ? and queue = {QUEUE_DAY_LRN} and due <= ? limit ?""",
         """
         if not now:
             now = intTime()
-        delays = delays[-left:]
+        cutoff = self.dayCutoff
         ok = 0
-        for i in range(len(delays)):
-            now += delays[i]*60
-            if now > self.dayCutoff:
+        for i, delay in enumerate(delays[-left:]):
+            now += delay*60
+            if now > cutoff:
                 break
             ok = i
         return ok+1
@@ -412,17 +511,18 @@ did = ? and queue = {QUEUE_DAY_LRN} and due <= ? limit ?""",
     def _logLrn(self, card, ease, conf, leaving, type, lastLeft):
         lastIvl = -(self._delayForGrade(conf, lastLeft))
         ivl = card.ivl if leaving else -(self._delayForGrade(conf, card.left))
-        def log():
-            self.col.db.execute(
-                "insert into revlog values (?,?,?,?,?,?,?,?,?)",
-                int(time.time()*1000), card.id, self.col.usn(), ease,
-                ivl, lastIvl, card.factor, card.timeTaken(), type)
+        self._insertRevlog(card, ease, ivl, lastIvl, type)
+
+    def _insertRevlog(self, card, ease, ivl, lastIvl, type):
+        """Add a revlog entry for CARD. Retry once if the database refuses it."""
+        args = (card.id, self.col.usn(), ease, ivl, lastIvl, card.factor,
+                card.timeTaken(), type)
         try:
-            log()
-        except:
+            self.col.db.execute(_revlogInsert, int(time.time()*1000), *args)
+        except DBError:
             # duplicate pk; retry in 10ms
             time.sleep(0.01)
-            log()
+            self.col.db.execute(_revlogInsert, int(time.time()*1000), *args)
 
     # Reviews
     ##########################################################################
@@ -440,12 +540,21 @@ did = ? and queue = {QUEUE_DAY_LRN} and due <= ? limit ?""",
             self.revCount -= 1
             return self.col.getCard(self._revQueue.pop())
 
+    def _revCountsForDecks(self, dids):
+        """Map each deck of dids having review cards due today to the
+        number of those cards (its subdecks' cards not included).
+
+        One grouped query instead of one query per deck."""
+        return dict(self.col.db.all(f"""
+select did, count() from cards where did in %s and queue = {QUEUE_REV}
+and due <= ? group by did""" % ids2str(dids), self.today))
+
     def totalRevForCurrentDeck(self):
         return self.col.db.scalar(
             f"""
 select count() from cards where id in (
 select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit ?)"""
-            % ids2str(self.col.decks.active()), self.today, self.reportLimit)
+            % self._deckLimit(), self.today, self.reportLimit)
 
     # Answering a review card
     ##########################################################################
@@ -539,11 +648,13 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
     # Tools
     ##########################################################################
 
+    @memoizedConf
     def _cardConf(self, card):
         """The configuration of this card's deck. See decks.py
         documentation to read more about them."""
         return self.col.decks.confForDid(card.did)
 
+    @memoizedConf
     def _newConf(self, card):
         """The configuration for "new" of this card's deck.See decks.py
         documentation to read more about them.
@@ -567,6 +678,7 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
             perDay=self.reportLimit
         )
 
+    @memoizedConf
     def _lapseConf(self, card):
         """The configuration for "lapse" of this card's deck.See decks.py
         documentation to read more about them.
@@ -590,6 +702,7 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
             resched=conf['resched'],
         )
 
+    @memoizedConf
     def _revConf(self, card):
         """The configuration for "review" of this card's deck.See decks.py
         documentation to read more about them.
@@ -604,8 +717,14 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
 
     def _deckLimit(self):
         """The list of active decks, as comma separated parenthesized
-        string"""
-        return ids2str(self.col.decks.active())
+        string.
+
+        It is rebuilt only when the list of active decks is replaced,
+        e.g. by decks.select()."""
+        active = self.col.decks.active()
+        if self._deckLimitCache[0] is not active:
+            self._deckLimitCache = (active, ids2str(active))
+        return self._deckLimitCache[1]
 
     # Daily cutoff
     ##########################################################################
@@ -615,6 +734,15 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
         if time.time() > self.dayCutoff:
             self.reset()
 
+    def _rollDeckCounts(self):
+        """Reset the daily counts of each deck whose counts are from
+        another day."""
+        today = self.today
+        for deck in self.col.decks.all():
+            for key in _todayKeys:
+                if deck[key][0] != today:
+                    deck[key] = [today, 0]
+
     # Deck finished state
     ##########################################################################
 
@@ -664,7 +792,7 @@ To study outside of the normal schedule, click the Custom Study button below."""
              "limit 1") % (self._deckLimit(),))
 
     def haveBuriedSiblings(self):
-        sdids = ids2str(self.col.decks.active())
+        sdids = self._deckLimit()
         cnt = self.col.db.scalar(
             f"select 1 from cards where queue = {QUEUE_USER_BURIED} and did in %s limit 1" % (sdids))
         return not not cnt
@@ -691,19 +819,71 @@ To study outside of the normal schedule, click the Custom Study button below."""
             "select id from cards where nid = ? and queue >= 0", nid)
         self.buryCards(cids)
 
+    def _updateCards(self, sql, ids, *args):
+        """Run the update SQL on the cards ids, a few hundred at a time.
+
+        sql -- ends with "id in %s", the place of the ids
+        args -- the values of the placeholders of sql"""
+        for chunk in chunkedIds(list(ids)):
+            self.col.db.execute(sql % ids2str(chunk), *args)
+
+    def _tagLeech(self, card):
+        """Add the leech tag to the card's note.
+
+        Only the note's tags are written; flushing the whole note would
+        also rewrite its fields and regenerate its cards."""
+        note = card.note()
+        # repeat leeches are usually tagged already
+        if note.hasTag("leech"):
+            return
+        note.addTag("leech")
+        self.col.tags.bulkAdd([card.nid], "leech")
+
+    def _updateCardsWhere(self, changes, where, *args):
+        """Update the cards matching WHERE with CHANGES, logging their ids
+        when the debug log is on. Used to unbury cards and empty filtered
+        decks.
+
+        args -- the values of the placeholders of CHANGES"""
+        sql = "update cards set %s where %s" % (changes, where)
+        if not self.col._debugLog:
+            self.col.db.execute(sql, *args)
+        elif _haveReturning:
+            self.col.log(self.col.db.list(sql + " returning id", *args))
+        else:
+            self.col.log(self.col.db.list("select id from cards where " + where))
+            self.col.db.execute(sql, *args)
+
     # Sibling spacing
     ##########################################################################
 
     def _burySiblings(self, card):
+        """Remove the siblings of card due today from the queues, and
+        bury those whose kind the deck options say to bury. The burying
+        itself is _buryAsSiblings, done by the concrete class."""
         toBury = []
         nconf = self._newConf(card)
         buryNew = nconf.get("bury", True)
         rconf = self._revConf(card)
         buryRev = rconf.get("bury", True)
+        siblings = f"""nid=? and id!=?
+and (queue={QUEUE_NEW_CRAM} or (queue={QUEUE_REV} and due<=?))"""
+        if buryNew and buryRev and _haveReturning:
+            # every sibling is buried, so find them while burying them
+            toBury = self.col.db.list(
+                f"update cards set queue={QUEUE_USER_BURIED},mod=?,usn=? where {siblings} returning id",
+                intTime(), self.col.usn(), card.nid, card.id, self.today)
+            for cid in toBury:
+                for queue in self._revQueue, self._newQueue:
+                    try:
+                        queue.remove(cid)
+                    except ValueError:
+                        pass
+            self.col.log(toBury)
+            return
         # loop through and remove from queues
-        for cid,queue in self.col.db.execute(f"""
-select id, queue from cards where nid=? and id!=?
-and (queue={QUEUE_NEW_CRAM} or (queue={QUEUE_REV} and due<=?))""",
+        for cid,queue in self.col.db.execute(
+                "select id, queue from cards where " + siblings,
                 card.nid, card.id, self.today):
             if queue == QUEUE_REV:
                 if buryRev:
@@ -721,8 +901,8 @@ and (queue={QUEUE_NEW_CRAM} or (queue={QUEUE_REV} and due<=?))""",
                     self._newQueue.remove(cid)
                 except ValueError:
                     pass
-        # burying is done by the concrete class
-        return toBury
+        if toBury:
+            self._buryAsSiblings(toBury)
 
     # Resetting
     ##########################################################################
@@ -62,7 +62,7 @@ class Card:
     wasNew --
     """
 
-    def __init__(self, col, id=None):
+    def __init__(self, col, id=None, row=None):
         """
         This function returns a card object from the collection given in argument.
 
@@ -72,12 +72,15 @@ class Card:
         Keyword arguments:
         col -- a collection
         id -- an identifier of a card. Int.
+        row -- the card's row of the cards table, if already fetched.
         """
         self.col = col
         self.timerStarted = None
         self._qa = None
         self._note = None
-        if id:
+        if row:
+            self.load(row)
+        elif id:
             self.id = id
             self.load()
         else:
@@ -97,11 +100,16 @@ class Card:
             self.flags = 0
             self.data = ""
 
-    def load(self):
+    def load(self, row=None):
         """
         Given a card, complete it with the information extracted from the database.
 
-        It is assumed that the card's id and col are already known."""
+        It is assumed that the card's id and col are already known.
+
+        row -- the card's row of the cards table. Queried if not given."""
+        if row is None:
+            row = self.col.db.first(
+                "select * from cards where id = ?", self.id)
         (self.id,
          self.nid,
          self.did,
@@ -119,8 +127,7 @@ class Card:
          self.odue,
          self.odid,
          self.flags,
-         self.data) = self.col.db.first(
-             "select * from cards where id = ?", self.id)
+         self.data) = row
         self._qa = None
         self._note = None
 
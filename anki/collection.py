@@ -10,7 +10,7 @@ import random
 import stat
 import datetime
 import copy
-import traceback
+import sys
 import json
 
 from anki.lang import _, ngettext
@@ -662,7 +662,8 @@ select id from notes where id in %s and id not in (select nid from cards)""" %
 
     def emptyCardReport(self, cids):
         models = self.models
-        rep = ""
+        emptyCards = _("Empty cards")
+        rep = []
         for ords, mid, flds in self.db.all("""
         select group_concat(ord), mid, flds from cards c, notes n
         where c.nid = n.id and c.id in %s group by nid order by mid""" % ids2str(cids)):
@@ -670,16 +671,16 @@ select id from notes where id in %s and id not in (select nid from cards)""" %
             modelName  = model["name"]
             templates = model["tmpls"]
             isCloze = model["type"] == MODEL_CLOZE
-            rep += _("Empty cards")+" ("+modelName+"): "
+            rep.append(emptyCards+" ("+modelName+"): ")
             if isCloze:
-                 rep+=ords
+                 rep.append(ords)
             else:
                 for ord in ords.split(","):
                     ord  = int(ord)
                     templateName = templates[ord]["name"]
-                    rep += templateName+", "
-            rep +="\nFields: %(f)s\n\n" % dict(f=flds.replace("\x1f", " / "))
-        return rep
+                    rep.append(templateName+", ")
+            rep.append("\nFields: %(f)s\n\n" % dict(f=flds.replace("\x1f", " / ")))
+        return "".join(rep)
 
     def addDelay(self, cids):
         (delay, delayResp) = getText("How many day to add to cards ? (negative number to substract days)")
@@ -1310,8 +1311,10 @@ ooo
             if isinstance(x, str):
                 return x
             return pprint.pformat(x)
-        path, num, fn, y = traceback.extract_stack(
-            limit=2+kwargs.get("stack", 0))[0]
+        # only the caller's file and function are needed, so don't let
+        # traceback look up the source lines of the whole stack
+        code = sys._getframe(1+kwargs.get("stack", 0)).f_code
+        path, fn = code.co_filename, code.co_name
         time = datetime.datetime.now()
         buf = "[%s] %s:%s(): %s" % (time, os.path.basename(path), fn,
                                      ", ".join([customRepr(x) for x in args]))
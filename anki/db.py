@@ -4,14 +4,20 @@
 
 import os
 import time
+from contextlib import contextmanager
 
 from sqlite3 import dbapi2 as sqlite, Cursor
 
 DBError = sqlite.Error
 
+# the scheduler's queries are the same text for a whole day, but many
+# others inline id lists; keep room for the former in the cache
+_cachedStatements = 256
+
 class DB:
     def __init__(self, path, timeout=0):
-        self._db = sqlite.connect(path, timeout=timeout)
+        self._db = sqlite.connect(path, timeout=timeout,
+                                  cached_statements=_cachedStatements)
         self._db.text_factory = self._textFactory
         self._path = path
         self.echo = os.environ.get("DBECHO")
@@ -65,6 +71,23 @@ class DB:
         if self.echo:
             print("commit %0.3fms" % ((time.time() - t)*1000))
 
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements in a single transaction.
+
+        Does nothing if a transaction is already open, which is the case
+        while the collection is locked."""
+        if self._db.in_transaction:
+            yield self
+            return
+        self._db.execute("begin")
+        try:
+            yield self
+        except:
+            self._db.rollback()
+            raise
+        self._db.commit()
+
     def executescript(self, sql):
         """executescript with sql on the database.
          If self.echo, prints sql
@@ -2,14 +2,34 @@
 # Copyright: Ankitects Pty Ltd and contributors
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-import re, os, zipfile, shutil, unicodedata
+import re, os, io, sys, zipfile, shutil, unicodedata
 import json
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from anki.lang import _
 from anki.utils import ids2str, splitFields, namedtmp, stripHTML
 from anki.hooks import runHook
 from anki import Collection
-from anki.cards import siblings
+from anki.cards import Card, siblings
+
+_styleRe = re.compile(r"(?i)<style>.*?</style>")
+_typeRe = re.compile(r"\[\[type:[^]]+\]\]")
+_brRe = re.compile(r"(?i)<(br ?/?|div|p)>")
+_soundRe = re.compile(r"\[sound:[^]]+\]")
+_wsRe = re.compile(r"[ \n\t]+")
+_answerRe = re.compile(r"(?si)^.*<hr id=answer>\n*")
+_nlTabTable = str.maketrans({"\n": " ", "\t": " " * 8})
+_tab = b"\t"
+_nl = b"\n"
+
+def _nfc(s):
+    "s in NFC form. Ascii strings, the usual media names, already are."
+    try:
+        s.encode("ascii")
+    except UnicodeEncodeError:
+        return unicodedata.normalize("NFC", s)
+    return s
 
 class Exporter:
     """An abstract class. Inherited by class actually doing some kind of export.
@@ -35,9 +55,10 @@ class Exporter:
         Keyword arguments:
         path -- a path of file in which to export"""
         self._escapeCount = 0# not used ANYWHERE in the code as of 25 november 2018
-        file = open(path, "wb")
-        self.doExport(file)
-        file.close()
+        # doExport() writes row by row, so buffer the writes ourselves
+        raw = open(path, "wb", buffering=0)
+        with io.BufferedWriter(raw, buffer_size=1<<20) as file:
+            self.doExport(file)
 
     def processText(self, text):
         if self.includeHTML is False:
@@ -51,10 +72,9 @@ class Exporter:
         "Escape newlines, tabs, CSS and quotechar."
         # fixme: we should probably quote fields with newlines
         # instead of converting them to spaces
-        text = text.replace("\n", " ")
-        text = text.replace("\t", " " * 8)
-        text = re.sub("(?i)<style>.*?</style>", "", text)
-        text = re.sub(r"\[\[type:[^]]+\]\]", "", text)
+        text = text.translate(_nlTabTable)
+        text = _styleRe.sub("", text)
+        text = _typeRe.sub("", text)
         if "\"" in text:
             text = "\"" + text.replace("\"", "\"\"") + "\""
         return text
@@ -62,24 +82,28 @@ class Exporter:
     def stripHTML(self, text):
         # very basic conversion to text
         s = text
-        s = re.sub(r"(?i)<(br ?/?|div|p)>", " ", s)
-        s = re.sub(r"\[sound:[^]]+\]", "", s)
+        s = _brRe.sub(" ", s)
+        s = _soundRe.sub("", s)
         s = stripHTML(s)
-        s = re.sub(r"[ \n\t]+", " ", s)
+        # only collapse whitespace when there is something to collapse
+        if "\n" in s or "\t" in s or "  " in s:
+            s = _wsRe.sub(" ", s)
         s = s.strip()
         return s
 
     def cardIds(self):
-        """card ids of cards in deck self.did if it is set, all ids otherwise."""
+        """card ids of cards in deck self.did if it is set, all ids
+        otherwise. Sorted and without duplicates."""
         if self.cids is not None:
             cids= self.cids
         elif not self.did:
             cids = self.col.db.list("select id from cards")
         else:
             cids = self.col.decks.cids(self.did, children=True)
-        self.count = len(cids)
         if self.col.conf.get("exportSiblings", False):
             cids = siblings(cids)
+        cids = sorted(set(cids))
+        self.count = len(cids)
         return cids
 
 
@@ -96,18 +120,26 @@ class TextCardExporter(Exporter):
         Exporter.__init__(self, col)
 
     def doExport(self, file):
-        ids = sorted(self.cardIds())
-        strids = ids2str(ids)
+        ids = self.cardIds()
         def esc(s):
             # strip off the repeated question in answer if exists
-            s = re.sub("(?si)^.*<hr id=answer>\n*", "", s)
+            s = _answerRe.sub("", s)
             return self.processText(s)
-        out = ""
-        for cid in ids:
-            c = self.col.getCard(cid)
-            out += esc(c.q())
-            out += "\t" + esc(c.a()) + "\n"
-        file.write(out.encode("utf-8"))
+        write = file.write
+        for c in self._cards(ids):
+            write(esc(c.q()).encode("utf-8"))
+            write(_tab)
+            write(esc(c.a()).encode("utf-8"))
+            write(_nl)
+
+    def _cards(self, ids, chunk=1000):
+        """The cards whose ids are in ids, loaded chunk by chunk rather
+        than with one query per card."""
+        for i in range(0, len(ids), chunk):
+            for row in self.col.db.all(
+                    "select * from cards where id in %s order by id" %
+                    ids2str(ids[i:i+chunk])):
+                yield Card(self.col, row=row)
 
 # Notes as TSV
 ######################################################################
@@ -125,7 +157,7 @@ class TextNoteExporter(Exporter):
 
     def doExport(self, file):
         cardIds = self.cardIds()
-        data = []
+        self.count = 0
         for id, flds, tags in self.col.db.execute("""
 select guid, flds, tags from notes
 where id in
@@ -140,10 +172,11 @@ where cards.id in %s)""" % ids2str(cardIds)):
             # tags
             if self.includeTags:
                 row.append(tags.strip())
-            data.append("\t".join(row))
-        self.count = len(data)
-        out = "\n".join(data)
-        file.write(out.encode("utf-8"))
+            # rows are separated, not terminated, by newlines
+            if self.count:
+                file.write(_nl)
+            file.write("\t".join(row).encode("utf-8"))
+            self.count += 1
 
 # Anki decks
 ######################################################################
@@ -169,15 +202,26 @@ class AnkiExporter(Exporter):
         except (IOError, OSError):
             pass
         self.dst = Collection(path)
+        # the target is a scratch file we just created, so don't wait on
+        # fsyncs. All writes below already share the single transaction
+        # opened by the collection's lock.
+        self.dst.db.setAutocommit(True)
+        self.dst.db.execute("pragma synchronous = off")
+        self.dst.db.setAutocommit(False)
+        self.dst.lock()
         self.src = self.col
         # find cards
         cids = self.cardIds()
+        # staging ids in temp tables marks the db modified; don't let an
+        # export bump the collection's mod time
+        srcMod = self.src.db.mod
+        self._stageIds("_exp_cids", cids)
         # copy cards, noting used nids
-        nids = {}
+        nids = set()
         data = []
         for row in self.src.db.execute(
-            "select * from cards where id in "+ids2str(cids)):
-            nids[row[1]] = True
+            "select c.* from cards c join _exp_cids e on c.id = e.id"):
+            nids.add(row[1])
             data.append(row)
             # clear flags
             row = list(row)
@@ -186,10 +230,10 @@ class AnkiExporter(Exporter):
             "insert into cards values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
             data)
         # notes
-        strnids = ids2str(list(nids.keys()))
+        self._stageIds("_exp_nids", nids)
         notedata = []
         for row in self.src.db.all(
-            "select * from notes where id in "+strnids):
+            "select n.* from notes n join _exp_nids e on n.id = e.id"):
             # remove system tags if not exporting scheduling info
             if not self.includeSched:
                 row = list(row)
@@ -198,19 +242,22 @@ class AnkiExporter(Exporter):
         self.dst.db.executemany(
             "insert into notes values (?,?,?,?,?,?,?,?,?,?,?)",
             notedata)
-        # models used by the notes
-        mids = self.dst.db.list("select distinct mid from notes where id in "+
-                                strnids)
+        del notedata
+        # models used by the notes; dst only holds the exported notes
+        mids = self.dst.db.list("select distinct mid from notes")
         # card history and revlog
         if self.includeSched:
             data = self.src.db.all(
-                "select * from revlog where cid in "+ids2str(cids))
+                "select r.* from revlog r join _exp_cids e on r.cid = e.id")
             self.dst.db.executemany(
                 "insert into revlog values (?,?,?,?,?,?,?,?,?)",
                 data)
         else:
             # need to reset card state
             self.dst.sched.resetCards(cids)
+        self.src.db.execute("drop table _exp_cids")
+        self.src.db.execute("drop table _exp_nids")
+        self.src.db.mod = srcMod
         # models - start with zero
         self.dst.models.models = {}
         for m in self.src.models.all():
@@ -241,30 +288,34 @@ class AnkiExporter(Exporter):
             if dc['id'] in dconfs:
                 self.dst.decks.updateConf(dc)
         # find used media
-        media = {}
+        media = set()
         self.mediaDir = self.src.media.dir()
         if self.includeMedia:
-            for row in notedata:
-                flds = row[6]
-                mid = row[2]
+            # dst holds exactly the exported notes; stream their fields
+            # rather than keeping every note row alive for this scan
+            for mid, flds in self.dst.db.execute(
+                    "select mid, flds from notes order by mid"):
                 for file in self.src.media.filesInStr(mid, flds):
                     # skip files in subdirs
                     if file != os.path.basename(file):
                         continue
-                    media[file] = True
+                    media.add(file)
             if self.mediaDir:
+                # only the exported notes' models can reference _files
+                mids = set(mids)
+                usedModels = [m for m in self.src.models.all()
+                              if int(m['id']) in mids]
                 for fname in os.listdir(self.mediaDir):
+                    if not fname.startswith("_"):
+                        continue
                     path = os.path.join(self.mediaDir, fname)
                     if os.path.isdir(path):
                         continue
-                    if fname.startswith("_"):
-                        # Scan all models in mids for reference to fname
-                        for m in self.src.models.all():
-                            if int(m['id']) in mids:
-                                if self._modelHasMedia(m, fname):
-                                    media[fname] = True
-                                    break
-        self.mediaFiles = list(media.keys())
+                    for m in usedModels:
+                        if self._modelHasMedia(m, fname):
+                            media.add(fname)
+                            break
+        self.mediaFiles = list(media)
         self.dst.crt = self.src.crt
         # todo: tags?
         self.count = self.dst.cardCount()
@@ -272,6 +323,16 @@ class AnkiExporter(Exporter):
         self.postExport()
         self.dst.close()
 
+    def _stageIds(self, table, ids):
+        """Fill the temp table `table` of the source collection with ids,
+        so that queries can join on it instead of a huge IN (...) list."""
+        self.src.db.execute(
+            "create temp table if not exists %s (id integer primary key)" % table)
+        self.src.db.execute("delete from %s" % table)
+        self.src.db.executemany(
+            "insert or ignore into %s values (?)" % table,
+            ((id,) for id in ids))
+
     def postExport(self):
         # overwrite to apply customizations to the deck before it's closed,
         # such as update the deck description
@@ -302,8 +363,14 @@ class AnkiPackageExporter(AnkiExporter):
         AnkiExporter.__init__(self, col)
 
     def exportInto(self, path):
-        # open a zip file
-        z = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        # open a zip file. Deflating a large collection dominates the
+        # export time, so favour speed over size where Python allows it
+        # (compresslevel is 3.7+)
+        kwargs = {}
+        if sys.version_info >= (3, 7):
+            kwargs['compresslevel'] = 1
+        z = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True,
+                            **kwargs)
         media = self.doExport(z, path)
         # media map
         z.writestr("media", json.dumps(media))
@@ -338,21 +405,58 @@ class AnkiPackageExporter(AnkiExporter):
 
     def _exportMedia(self, z, files, fdir):
         media = {}
-        for c, file in enumerate(files):
-            cStr = str(c)
-            mpath = os.path.join(fdir, file)
-            if os.path.isdir(mpath):
-                continue
-            if os.path.exists(mpath):
-                if re.search(r'\.svg$', file, re.IGNORECASE):
-                    z.write(mpath, cStr, zipfile.ZIP_DEFLATED)
-                else:
-                    z.write(mpath, cStr, zipfile.ZIP_STORED)
-                media[cStr] = unicodedata.normalize("NFC", file)
-                runHook("exportedMediaFiles", c)
-
+        # the zip file can only be written from this thread, but reading the
+        # next few files can overlap with compressing and writing this one
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for c, file in enumerate(files):
+                mpath = os.path.join(fdir, file)
+                pending.append((c, file, mpath,
+                                pool.submit(self._readMedia, mpath, str(c))))
+                if len(pending) >= self._mediaReadAhead:
+                    self._writeMedia(z, media, *pending.popleft())
+            while pending:
+                self._writeMedia(z, media, *pending.popleft())
         return media
 
+    # number of media files read ahead of the one being written
+    _mediaReadAhead = 8
+    # larger files are not read ahead, to bound memory use
+    _mediaReadAheadSize = 1<<24
+
+    def _readMedia(self, mpath, arcname):
+        """(info, data) for the file mpath stored as arcname, where data is
+        None if the file is too big to be read ahead. None if it's not a
+        regular file."""
+        if os.path.isdir(mpath) or not os.path.exists(mpath):
+            return None
+        info = zipfile.ZipInfo.from_file(mpath, arcname)
+        if info.file_size > self._mediaReadAheadSize:
+            return (info, None)
+        with open(mpath, "rb") as f:
+            return (info, f.read())
+
+    def _writeMedia(self, z, media, c, file, mpath, future):
+        read = future.result()
+        if read is None:
+            return
+        info, data = read
+        cStr = str(c)
+        if file[-4:].lower() == ".svg":
+            compression = zipfile.ZIP_DEFLATED
+        else:
+            compression = zipfile.ZIP_STORED
+        if data is None:
+            z.write(mpath, cStr, compression)
+        else:
+            info.compress_type = compression
+            kwargs = {}
+            if sys.version_info >= (3, 7):
+                kwargs['compresslevel'] = z.compresslevel
+            z.writestr(info, data, **kwargs)
+        media[cStr] = _nfc(file)
+        runHook("exportedMediaFiles", c)
+
     def prepareMedia(self):
         # chance to move each file in self.mediaFiles into place before media
         # is zipped up
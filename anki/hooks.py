@@ -67,6 +67,10 @@ def remHook(hook, func):
     if func in hook:
         hook.remove(func)
 
+def hookCount(hook):
+    "Number of functions on hook."
+    return len(_hooks.get(hook, []))
+
 # Instrumenting
 ##############################################################################
 
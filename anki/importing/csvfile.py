@@ -3,7 +3,6 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
 import csv
-import re
 
 from anki.importing.noteimp import NoteImporter, ForeignNote
 from anki.lang import _
@@ -32,21 +31,24 @@ class TextImporter(NoteImporter):
             reader = csv.reader(self.data, delimiter=self.delimiter, doublequote=True)
         else:
             reader = csv.reader(self.data, self.dialect, doublequote=True)
+        # the loop runs once per line of the file; bind what it uses
+        numFields = self.numFields
+        noteFromFields = self.noteFromFields
+        addNote = notes.append
         try:
             for row in reader:
-                if len(row) != self.numFields:
+                if len(row) != numFields:
                     if row:
                         log.append(_(
                             "'%(row)s' had %(num1)d fields, "
                             "expected %(num2)d") % {
                             "row": " ".join(row),
                             "num1": len(row),
-                            "num2": self.numFields,
+                            "num2": numFields,
                             })
                         ignored += 1
                     continue
-                note = self.noteFromFields(row)
-                notes.append(note)
+                addNote(noteFromFields(row))
         except (csv.Error) as e:
             log.append(_("Aborted: %s") % str(e))
         self.log = log
@@ -76,11 +78,9 @@ class TextImporter(NoteImporter):
         """
         self.dialect = None
         self.fileobj = open(self.file, "r", encoding='utf-8-sig')
-        self.data = self.fileobj.read()
-        def sub(s):
-            return re.sub(r"^\#.*$", "__comment", s)
         #set of lines not starting with #
-        self.data = [sub(x)+"\n" for x in self.data.split("\n") if sub(x) != "__comment"]
+        self.data = [line if line.endswith("\n") else line+"\n"
+                     for line in self.fileobj if not line.startswith("#")]
         if self.data:
             if self.data[0].startswith("tags:"):
                 tags = str(self.data[0][5:]).strip()
@@ -102,7 +102,8 @@ class TextImporter(NoteImporter):
         sniffer = csv.Sniffer()
         if not self.delimiter:
             try:
-                self.dialect = sniffer.sniff("\n".join(self.data[:10]),
+                # lines already end with a newline
+                self.dialect = sniffer.sniff("".join(self.data[:10]),
                                              self.patterns)
             except:
                 try:
@@ -142,6 +143,6 @@ class TextImporter(NoteImporter):
 
     def noteFromFields(self, fields):
         note = ForeignNote()
-        note.fields.extend([x for x in fields])
+        note.fields.extend(fields)
         note.tags.extend(self.tagsToAdd)
         return note
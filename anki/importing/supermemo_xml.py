@@ -134,7 +134,7 @@ class SupermemoXmlImporter(NoteImporter):
         from bs4 import BeautifulSoup as btflsoup
 
         #my sm2004 also ecaped & char in escaped sequences.
-        s = re.sub('&amp;','&',s)
+        s = s.replace('&amp;','&')
         #unescaped solitary chars < or > that were ok for minidom confuse btfl soup
         #s = re.sub(u'>',u'&gt;',s)
         #s = re.sub(u'<',u'&lt;',s)
@@ -8,6 +8,7 @@ class Scheduler(BothScheduler):
     name = "std"
     _spreadRev = True
 
+    @withConfCache
     def answerCard(self, card, ease):
         """Change the number of card to see in the decks and its
         ancestors. Change the due/interval/ease factor of this card,
@@ -69,7 +70,6 @@ class Scheduler(BothScheduler):
                 counts[idx] += 1
         cur = self.col.decks.current()
         conf = self.col.decks.confForDid(cur['id'])
-        from aqt import mw
         if (not sync) and self.col.conf.get("limitAllCards", False):
             today = conf['perDay'] - cur['revToday'][1] - cur['newToday'][1]
             counts.append(today)
@@ -102,19 +102,13 @@ class Scheduler(BothScheduler):
     def unburyCards(self):
         "Unbury cards."
         self.col.conf['lastUnburied'] = self.today
-        self.col.log(
-            self.col.db.list(f"select id from cards where queue = {QUEUE_USER_BURIED}"))
-        self.col.db.execute(
-            f"update cards set queue=type where queue = {QUEUE_USER_BURIED}")
+        self._updateCardsWhere("queue=type", f"queue = {QUEUE_USER_BURIED}")
 
     def unburyCardsForDeck(self):
-        sids = ids2str(self.col.decks.active())
-        self.col.log(
-            self.col.db.list(f"select id from cards where queue = {QUEUE_USER_BURIED} and did in %s"
-                             % (sids)))
-        self.col.db.execute(
-            f"update cards set mod=?,usn=?,queue=type where queue = {QUEUE_USER_BURIED} and did in %s"
-            % (sids), intTime(), self.col.usn())
+        self._updateCardsWhere(
+            "mod=?,usn=?,queue=type",
+            f"queue = {QUEUE_USER_BURIED} and did in %s" % self._deckLimit(),
+            intTime(), self.col.usn())
 
     # Rev/lrn/time daily stats
     ##########################################################################
@@ -128,40 +122,47 @@ class Scheduler(BothScheduler):
 
         [deckname (with ::),
         did, rev, lrn, new (not counting subdeck)]"""
-        self._checkDay()
-        self.col.decks.checkIntegrity()
-        decks = self.col.decks.all()
-        decks.sort(key=itemgetter('name'))
-        #lims -- associating to each deck maximum number of new card and of review. Taking custom study into account
-        lims = {}
-        data = []
-        def parent(name):
-            parts = name.split("::")
-            if len(parts) < 2:
-                return None
-            parts = parts[:-1]
-            return "::".join(parts)
-        for deck in decks:
-            p = parent(deck['name'])
-            # new
-            #nlim -- maximal number of new card, taking parent into account
-            nlim = self._deckNewLimitSingle(deck)
-            if p:
-                nlim = min(nlim, lims[p][0])
-            new = self._newForDeck(deck['id'], nlim)
-            # learning
-            lrn = self._lrnForDeck(deck['id'])
-            # reviews
-            #rlim -- maximal number of review, taking parent into account
-            rlim = self._deckRevLimitSingle(deck)
-            if p:
-                rlim = min(rlim, lims[p][1])
-            rev = self._revForDeck(deck['id'], rlim)
-            # save to list
-            data.append([deck['name'], deck['id'], rev, lrn, new])
-            # add deck as a parent
-            lims[deck['name']] = [nlim, rlim]
-        return data
+        with self.col.db.transaction():
+            self._checkDay()
+            self.col.decks.checkIntegrity()
+            decks = self.col.decks.all()
+            decks.sort(key=itemgetter('name'))
+            #lims -- associating to each deck maximum number of new card and of review. Taking custom study into account
+            lims = {}
+            data = []
+            def parent(name):
+                parts = name.split("::")
+                if len(parts) < 2:
+                    return None
+                parts = parts[:-1]
+                return "::".join(parts)
+            # learning and review counts of all decks, fetched at once
+            dids = [deck['id'] for deck in decks]
+            lrnCounts = self._lrnForDecks(dids)
+            revCounts = self._revCountsForDecks(dids)
+            for deck in decks:
+                p = parent(deck['name'])
+                # both limits read the same conf
+                conf = None if deck['dyn'] else self.col.decks.confForDid(deck['id'])
+                # new
+                #nlim -- maximal number of new card, taking parent into account
+                nlim = self._deckNewLimitSingle(deck, conf=conf)
+                if p:
+                    nlim = min(nlim, lims[p][0])
+                new = self._newForDeck(deck['id'], nlim)
+                # learning
+                lrn = lrnCounts.get(deck['id'], 0)
+                # reviews
+                #rlim -- maximal number of review, taking parent into account
+                rlim = self._deckRevLimitSingle(deck, conf=conf)
+                if p:
+                    rlim = min(rlim, lims[p][1])
+                rev = min(revCounts.get(deck['id'], 0), rlim, self.reportLimit)
+                # save to list
+                data.append([deck['name'], deck['id'], rev, lrn, new])
+                # add deck as a parent
+                lims[deck['name']] = [nlim, rlim]
+            return data
 
     def deckDueTree(self):
         """Generate the node of the main deck. See deckbroser introduction to see what a node is
@@ -172,50 +173,22 @@ class Scheduler(BothScheduler):
         nodes=self._groupChildren(nodes_)
         return nodes
 
-    def _groupChildrenMain(self, grps):
-        """
-        [subdeck name without parent parts,
-        did, rev, lrn, new (counting subdecks)
-        [recursively the same things for the children]]
-
-        keyword arguments:
-        grps -- [[subdeck], did, rev, lrn, new] sorted according to the list subdeck. Number for the subdeck precisely"""
-        tree = []
-        # group and recurse
-        def key(grp):
-            return grp[0][0]
-        for (head, tail) in itertools.groupby(grps, key=key):
-            tail = list(tail)
-            did = None
-            rev = 0
-            new = 0
-            lrn = 0
-            children = []
-            for c in tail:
-                if len(c[0]) == 1:
-                    # current node
-                    did = c[1]
-                    rev += c[2]
-                    lrn += c[3]
-                    new += c[4]
-                else:
-                    # set new string to tail
-                    c[0] = c[0][1:]
-                    children.append(c)
-            children = self._groupChildrenMain(children)
-            # tally up children counts
-            for ch in children:
-                rev += ch[2]
-                lrn += ch[3]
-                new += ch[4]
-            # limit the counts to the deck's limits
-            conf = self.col.decks.confForDid(did)
-            deck = self.col.decks.get(did)
-            if not conf['dyn']:
-                rev = max(0, min(rev, conf['rev']['perDay']-deck['revToday'][1]))
-                new = max(0, min(new, conf['new']['perDay']-deck['newToday'][1]))
-            tree.append((head, did, rev, lrn, new, children))
-        return tuple(tree)
+    def _groupChildrenNode(self, head, did, rev, lrn, new, children):
+        """The node of deck did, whose own counts are rev, lrn and new:
+        the children's counts are added, then capped by the deck's
+        limits."""
+        # tally up children counts
+        for ch in children:
+            rev += ch[2]
+            lrn += ch[3]
+            new += ch[4]
+        # limit the counts to the deck's limits
+        conf = self.col.decks.confForDid(did)
+        deck = self.col.decks.get(did)
+        if not conf['dyn']:
+            rev = max(0, min(rev, conf['rev']['perDay']-deck['revToday'][1]))
+            new = max(0, min(new, conf['new']['perDay']-deck['newToday'][1]))
+        return (head, did, rev, lrn, new, children)
 
     # Getting the next card
     ##########################################################################
@@ -249,7 +222,7 @@ class Scheduler(BothScheduler):
     # New cards
     ##########################################################################
 
-    def _deckNewLimitSingle(self, deck, sync=False):
+    def _deckNewLimitSingle(self, deck, sync=False, conf=None):
         """Maximum number of new card to see today for deck deck, not considering parent limit.
 
         If deck is a dynamic deck, then reportLimit.
@@ -258,13 +231,13 @@ class Scheduler(BothScheduler):
         keyword arguments:
         deck -- a deck dictionnary
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
+        conf -- the deck's conf, if the caller already has it
         """
         if deck['dyn']:
             return self.reportLimit
-        c = self.col.decks.confForDid(deck['id'])
+        c = conf or self.col.decks.confForDid(deck['id'])
         nbNewToSee = c['new']['perDay'] - deck['newToday'][1]
-        from aqt import mw
-        if (not sync) and mw and mw.pm.profile.get("limitAllCards", False):
+        if (not sync) and self._limitAllCards:
             nbCardToSee = c.get('perDay', 1000) - deck['revToday'][1] - deck['newToday'][1]
             limit = min(nbNewToSee, nbCardToSee)
         else:
@@ -315,19 +288,20 @@ and due <= ? limit %d""" % (self._deckLimit(),  self.reportLimit),
         leaving = False
         # lrnCount was decremented once when card was fetched
         lastLeft = card.left
+        # real left count once this step is passed
+        left = lastLeft % 1000 - 1
         # immediate graduate?
         if ease == BUTTON_THREE:
             self._rescheduleAsRev(card, conf, True)
             leaving = True
         # graduation time?
-        elif ease == BUTTON_TWO and (card.left%1000)-1 <= 0:
+        elif ease == BUTTON_TWO and left <= 0:
             self._rescheduleAsRev(card, conf, False)
             leaving = True
         else:
             # one step towards graduation
             if ease == BUTTON_TWO:
-                # decrement real left count and recalculate left today
-                left = (card.left % 1000) - 1
+                # recalculate left today
                 card.left = self._leftToday(conf['delays'], left)*1000 + left
             # failed
             else:
@@ -342,10 +316,11 @@ and due <= ? limit %d""" % (self._deckLimit(),  self.reportLimit),
                 if resched and card.odid:
                     card.odue = self.today + 1
             delay = self._delayForGrade(conf, card.left)
-            if card.due < time.time():
+            now = time.time()
+            if card.due < now:
                 # not collapsed; add some randomness
                 delay *= random.uniform(1, 1.25)
-            card.due = int(time.time() + delay)
+            card.due = int(now + delay)
             # due today?
             if card.due < self.dayCutoff:
                 self.lrnCount += card.left // 1000
@@ -471,8 +446,11 @@ where queue in ({QUEUE_LRN},{QUEUE_DAY_LRN}) and type = {CARD_DUE}
 %s
 """ % (intTime(), self.col.usn(), extra))
         # new cards in learning
-        self.forgetCards(self.col.db.list(
-            f"select id from cards where queue in ({QUEUE_LRN}, {QUEUE_DAY_LRN}) %s" % extra))
+        nonRev = self.col.db.list(
+            f"select id from cards where queue in ({QUEUE_LRN}, {QUEUE_DAY_LRN}) %s" % extra)
+        # forgetting nothing would still cost four statements
+        if nonRev:
+            self.forgetCards(nonRev)
 
     def _lrnForDeck(self, did):
         """Number of review of cards in learing of deck did. """
@@ -488,6 +466,29 @@ select count() from
 and due <= ? limit ?)""" ,
             did, self.today, self.reportLimit)
 
+    def _lrnForDecks(self, dids):
+        """Map each deck of dids to its _lrnForDeck value, using one query
+        per learning queue rather than two queries per deck."""
+        counts = {}
+        for did, cnt, reps in self.col.db.execute(f"""
+select did, count(), sum(left/1000) from cards where did in %s
+and queue = {QUEUE_LRN} and due < ? group by did""" % ids2str(dids),
+                intTime() + self.col.conf['collapseTime']):
+            if cnt > self.reportLimit:
+                # only the reps of reportLimit cards are counted
+                reps = self.col.db.scalar(f"""
+select sum(left/1000) from
+(select left from cards where did = ? and queue = {QUEUE_LRN} and due < ? limit ?)""",
+                    did, intTime() + self.col.conf['collapseTime'],
+                    self.reportLimit)
+            counts[did] = reps or 0
+        for did, cnt in self.col.db.execute(f"""
+select did, count() from cards where did in %s
+and queue = {QUEUE_DAY_LRN} and due <= ? group by did""" % ids2str(dids),
+                self.today):
+            counts[did] = counts.get(did, 0) + min(cnt, self.reportLimit)
+        return counts
+
     # Reviews
     ##########################################################################
 
@@ -497,20 +498,20 @@ and due <= ? limit ?)""" ,
         """
         return self._deckNewLimit(did, lambda deck: self._deckRevLimitSingle(deck, sync=sync))
 
-    def _deckRevLimitSingle(self, deck, sync=False):
+    def _deckRevLimitSingle(self, deck, sync=False, conf=None):
         """Maximum number of card to review today in deck deck.
 
         self.reportLimit for dynamic deck. Otherwise the number of review according to deck option, plus the number of review added in custom study today.
         keyword arguments:
         deck -- a deck object
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
+        conf -- the deck's conf, if the caller already has it
         """
         if deck['dyn']:
             return self.reportLimit
-        c = self.col.decks.confForDid(deck['id'])
+        c = conf or self.col.decks.confForDid(deck['id'])
         nbRevToSee = c['rev']['perDay'] - deck['revToday'][1]
-        from aqt import mw
-        if (not sync) and mw and mw.pm.profile.get("limitAllCards", False):
+        if (not sync) and self._limitAllCards:
             nbCardToSee = c.get('perDay', 1000) - deck['revToday'][1] - deck['newToday'][1]
             limit = min(nbRevToSee, nbCardToSee)
         else:
@@ -534,12 +535,10 @@ and due <= ? limit ?)""",
         Set revCount
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
         """
+        revCounts = self._revCountsForDecks(self.col.decks.active())
         def cntFn(did, lim):
             """Number of review cards to see today for deck with id did. At most equal to lim."""
-            return self.col.db.scalar(f"""
-select count() from (select id from cards where
-did = ? and queue = {QUEUE_REV} and due <= ? limit %d)""" % (lim),
-                                      did, self.today)
+            return min(revCounts.get(did, 0), lim)
         self.revCount = self._walkingCount(
             lambda deck: self._deckRevLimitSingle(deck, sync), cntFn)
 
@@ -548,7 +547,7 @@ did = ? and queue = {QUEUE_REV} and due <= ? limit %d)""" % (lim),
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
         """
         super()._resetRev(sync=sync)
-        self._revDids = self.col.decks.active()[:]
+        self._revDids = collections.deque(self.col.decks.active())
 
     def _fillRev(self):
         if self._revQueue:
@@ -571,15 +570,13 @@ did = ? and queue = {QUEUE_REV} and due <= ? limit ?""",
                         self._revQueue.reverse()
                     else:
                         # random order for regular reviews
-                        r = random.Random()
-                        r.seed(self.today)
-                        r.shuffle(self._revQueue)
+                        random.Random(self.today).shuffle(self._revQueue)
                     # is the current did empty?
                     if len(self._revQueue) < lim:
-                        self._revDids.pop(0)
+                        self._revDids.popleft()
                     return True
             # nothing left in the deck; move to next
-            self._revDids.pop(0)
+            self._revDids.popleft()
         if self.revCount:
             # if we didn't get a card but the count is non-zero,
             # we need to check again for any cards that were
@@ -597,7 +594,7 @@ did = ? and queue = {QUEUE_REV} and due <= ? limit ?""",
             """
 select count() from cards where id in (
 select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit ?)"""
-            % ids2str(self.col.decks.active()), self.today, self.reportLimit)
+            % self._deckLimit(), self.today, self.reportLimit)
 
     # Answering a review card
     ##########################################################################
@@ -714,18 +711,7 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
         ease -- the button pressed
         delay -- if the answer is again, then the number of second until the next review
         """
-        def log():
-            self.col.db.execute(
-                "insert into revlog values (?,?,?,?,?,?,?,?,?)",
-                int(time.time()*1000), card.id, self.col.usn(), ease,
-                -delay or card.ivl, card.lastIvl, card.factor, card.timeTaken(),
-                1)
-        try:
-            log()
-        except:
-            # duplicate pk; retry in 10ms
-            time.sleep(0.01)
-            log()
+        self._insertRevlog(card, ease, -delay or card.ivl, card.lastIvl, 1)
 
     # Interval management
     ##########################################################################
@@ -738,16 +724,17 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
         delay = self._daysLate(card)
         conf = self._revConf(card)
         fct = card.factor / 1000
-        ivl2 = self._constrainedIvl((card.ivl + delay // 4) * 1.2, conf, card.ivl)
-        ivl3 = self._constrainedIvl((card.ivl + delay // 2) * fct, conf, ivl2)
-        ivl4 = self._constrainedIvl(
-            (card.ivl + delay) * fct * conf['ease4'], conf, ivl3)
-        if ease == BUTTON_TWO:
-            interval = ivl2
-        elif ease == BUTTON_THREE:
-            interval = ivl3
-        elif ease == BUTTON_FOUR:
-            interval = ivl4
+        ivlFct = conf.get('ivlFct', 1)
+        ivl = card.ivl
+        # each interval is bounded below by the previous ease's, so only
+        # compute the chain up to the requested ease; this is
+        # _constrainedIvl inlined
+        interval = int(max((ivl + delay // 4) * 1.2 * ivlFct, ivl+1))
+        if ease > BUTTON_TWO:
+            interval = int(max((ivl + delay // 2) * fct * ivlFct, interval+1))
+        if ease > BUTTON_THREE:
+            interval = int(max(
+                (ivl + delay) * fct * conf['ease4'] * ivlFct, interval+1))
         # interval capped?
         return min(interval, conf['maxIvl'])
 
@@ -810,32 +797,30 @@ select id from cards where did in %s and queue = {QUEUE_REV} and due <= ? limit
         """
         if not lim:
             lim = "did = %s" % did
-        self.col.log(self.col.db.list("select id from cards where %s" % lim))
         # move out of cram queue
-        self.col.db.execute(f"""
-update cards set did = odid, queue = (case when type = {CARD_LRN} then {QUEUE_NEW_CRAM}
+        self._updateCardsWhere(f"""
+did = odid, queue = (case when type = {CARD_LRN} then {QUEUE_NEW_CRAM}
 else type end), type = (case when type = {CARD_LRN} then {CARD_NEW} else type end),
-due = odue, odue = 0, odid = 0, usn = ? where %s""" % (lim),
-                            self.col.usn())
+due = odue, odue = 0, odid = 0, usn = ?""", lim, self.col.usn())
 
-    def _moveToDyn(self, did, ids):
-        deck = self.col.decks.get(did)
-        data = []
-        t = intTime(); u = self.col.usn()
-        for c, id in enumerate(ids):
-            # start at -100000 so that reviews are all due
-            data.append((did, -100000+c, u, id))
-        # due reviews stay in the review queue. careful: can't use
-        # "odid or did", as sqlite converts to boolean
-        queue = f"""
-(case when type={CARD_DUE} and (case when odue then odue <= %d else due <= %d end)
- then {QUEUE_REV} else {QUEUE_NEW_CRAM} end)"""
-        queue %= (self.today, self.today)
-        self.col.db.executemany("""
+    # due reviews stay in the review queue. careful: can't use
+    # "odid or did", as sqlite converts to boolean. the CASE is cheaper
+    # in sqlite than computing the queue in python from a prior select
+    _moveToDynQuery = f"""
 update cards set
 odid = (case when odid then odid else did end),
 odue = (case when odue then odue else due end),
-did = ?, queue = %s, due = ?, usn = ? where id = ?""" % queue, data)
+did = ?, queue = (case when type={CARD_DUE} and
+ (case when odue then odue <= %d else due <= %d end)
+ then {QUEUE_REV} else {QUEUE_NEW_CRAM} end),
+due = ?, usn = ? where id = ?"""
+
+    def _moveToDyn(self, did, ids):
+        u = self.col.usn()
+        # start at -100000 so that reviews are all due; executemany
+        # consumes the rows as they are generated
+        data = ((did, due, u, id) for due, id in enumerate(ids, -100000))
+        self.col.db.executemany(self._moveToDynSql, data)
 
     def _dynIvlBoost(self, card):
         """New interval for a review card in a dynamic interval.
@@ -869,9 +854,7 @@ did = ?, queue = %s, due = ?, usn = ? where id = ?""" % queue, data)
         if (card.lapses >= lf and
             (card.lapses-lf) % (max(lf // 2, 1)) == 0):
             # add a leech tag
-            f = card.note()
-            f.addTag("leech")
-            f.flush()
+            self._tagLeech(card)
             # handle
             a = conf['leechAction']
             if a == LEECH_SUSPEND:
@@ -920,21 +903,22 @@ did = ?, queue = %s, due = ?, usn = ? where id = ?""" % queue, data)
         self.today = int((time.time() - self.col.crt) // 86400)
         # end of day cutoff
         self.dayCutoff = self.col.crt + (self.today+1)*86400
+        # the same statement text all day lets sqlite reuse it
+        self._moveToDynSql = self._moveToDynQuery % (self.today, self.today)
         if oldToday != self.today:
             self.col.log(self.today, self.dayCutoff)
         # update all daily counts, but don't save decks to prevent needless
         # conflicts. we'll save on card answer instead
-        def update(deck):
-            for t in "new", "rev", "lrn", "time":
-                key = t+"Today"
-                if deck[key][0] != self.today:
-                    deck[key] = [self.today, 0]
-        for deck in self.col.decks.all():
-            update(deck)
+        self._rollDeckCounts()
         # unbury if the day has rolled over
         unburied = self.col.conf.get("lastUnburied", 0)
         if unburied < self.today:
-            self.unburyCards()
+            # an update matching nothing would still mark the db modified
+            if self.col.db.scalar(
+                    f"select 1 from cards where queue = {QUEUE_USER_BURIED} limit 1"):
+                self.unburyCards()
+            else:
+                self.col.conf['lastUnburied'] = self.today
 
     # Deck finished state
     ##########################################################################
@@ -945,6 +929,7 @@ did = ?, queue = %s, due = ?, usn = ? where id = ?""" % queue, data)
     # Next time reports
     ##########################################################################
 
+    @withConfCache
     def nextIvl(self, card, ease):
         "Return the next interval for CARD, in seconds."
         if card.queue in (QUEUE_NEW_CRAM, QUEUE_LRN, QUEUE_DAY_LRN):
@@ -991,39 +976,38 @@ did = ?, queue = %s, due = ?, usn = ? where id = ?""" % queue, data)
     def suspendCards(self, ids):
         "Suspend cards."
         self.col.log(ids)
-        self.remFromDyn(ids)
-        self.removeLrn(ids)
-        self.col.db.execute(
-            (f"update cards set queue={QUEUE_SUSPENDED},mod=?,usn=? where id in ")+
-            ids2str(ids), intTime(), self.col.usn())
+        with self.col.db.transaction():
+            self.remFromDyn(ids)
+            self.removeLrn(ids)
+            self._updateCards(
+                f"update cards set queue={QUEUE_SUSPENDED},mod=?,usn=? where id in %s",
+                ids, intTime(), self.col.usn())
 
     def unsuspendCards(self, ids):
         "Unsuspend cards."
         self.col.log(ids)
-        self.col.db.execute(
-            (f"update cards set queue=type,mod=?,usn=? "
-            f"where queue = {QUEUE_SUSPENDED} and id in ")+ ids2str(ids),
-            intTime(), self.col.usn())
+        self._updateCards(
+            f"update cards set queue=type,mod=?,usn=? "
+            f"where queue = {QUEUE_SUSPENDED} and id in %s",
+            ids, intTime(), self.col.usn())
 
     def buryCards(self, cids):
         self.col.log(cids)
-        self.remFromDyn(cids)
-        self.removeLrn(cids)
-        self.col.db.execute((f"""
-        update cards set queue={QUEUE_USER_BURIED},mod=?,usn=? where id in """)+ids2str(cids),
-                            intTime(), self.col.usn())
+        with self.col.db.transaction():
+            self.remFromDyn(cids)
+            self.removeLrn(cids)
+            self._updateCards(
+                f"update cards set queue={QUEUE_USER_BURIED},mod=?,usn=? where id in %s",
+                cids, intTime(), self.col.usn())
 
     # Sibling spacing
     ##########################################################################
 
-    def _burySiblings(self, card):
-        toBury = super()._burySiblings(card)
-        # then bury
-        if toBury:
-            self.col.db.execute(
-                (f"update cards set queue={QUEUE_USER_BURIED},mod=?,usn=? where id in ")+ids2str(toBury),
-                intTime(), self.col.usn())
-            self.col.log(toBury)
+    def _buryAsSiblings(self, toBury):
+        self._updateCards(
+            f"update cards set queue={QUEUE_USER_BURIED},mod=?,usn=? where id in %s",
+            toBury, intTime(), self.col.usn())
+        self.col.log(toBury)
 
     # Resetting
     ##########################################################################
@@ -12,6 +12,7 @@ class Scheduler(BothScheduler):
         self.dynReportLimit = 99999
         self._lrnCutoff = 0
 
+    @withConfCache
     def answerCard(self, card, ease):
         self.col.log()
         assert 1 <= ease <= 4
@@ -78,7 +79,6 @@ class Scheduler(BothScheduler):
         if card:
             idx = self.countIdx(card)
             counts[idx] += 1
-        from aqt import mw
         if (not sync) and self.col.conf.get("limitAllCards", False):
             counts.append(counts[0] + counts[2]- deck['revToday'][1] - deck['newToday'][1] - deck['lrnToday'][1])
         return tuple(counts)
@@ -103,79 +103,68 @@ class Scheduler(BothScheduler):
 
     def deckDueList(self):
         "Returns [deckname, did, rev, lrn, new]"
-        self._checkDay()
-        self.col.decks.checkIntegrity()
-        decks = self.col.decks.all()
-        decks.sort(key=itemgetter('name'))
-        lims = {}
-        data = []
-        def parent(name):
-            parts = name.split("::")
-            if len(parts) < 2:
-                return None
-            parts = parts[:-1]
-            return "::".join(parts)
-        childMap = self.col.decks.childMap()
-        for deck in decks:
-            p = parent(deck['name'])
-            # new
-            nlim = self._deckNewLimitSingle(deck)
-            if p:
-                nlim = min(nlim, lims[p][0])
-            new = self._newForDeck(deck['id'], nlim)
-            # learning
-            lrn = self._lrnForDeck(deck['id'])
-            # reviews
-            if p:
-                plim = lims[p][1]
-            else:
-                plim = None
-            rlim = self._deckRevLimitSingle(deck, parentLimit=plim)
-            rev = self._revForDeck(deck['id'], rlim, childMap)
-            # save to list
-            data.append([deck['name'], deck['id'], rev, lrn, new])
-            # add deck as a parent
-            lims[deck['name']] = [nlim, rlim]
-        return data
+        with self.col.db.transaction():
+            self._checkDay()
+            self.col.decks.checkIntegrity()
+            decks = self.col.decks.all()
+            decks.sort(key=itemgetter('name'))
+            lims = {}
+            data = []
+            def parent(name):
+                parts = name.split("::")
+                if len(parts) < 2:
+                    return None
+                parts = parts[:-1]
+                return "::".join(parts)
+            childMap = self.col.decks.childMap()
+            # learning and review counts of all decks, fetched at once
+            dids = [deck['id'] for deck in decks]
+            lrnCounts = self._lrnForDecks(dids)
+            revCounts = self._revCountsForDecks(dids)
+            for deck in decks:
+                p = parent(deck['name'])
+                # both limits read the same conf
+                conf = None if deck['dyn'] else self.col.decks.confForDid(deck['id'])
+                # new
+                nlim = self._deckNewLimitSingle(deck, conf=conf)
+                if p:
+                    nlim = min(nlim, lims[p][0])
+                new = self._newForDeck(deck['id'], nlim)
+                # learning
+                lrn = lrnCounts.get(deck['id'], 0)
+                # reviews
+                if p:
+                    plim = lims[p][1]
+                else:
+                    plim = None
+                rlim = self._deckRevLimitSingle(deck, parentLimit=plim, conf=conf)
+                rev = min(
+                    sum(revCounts.get(did, 0) for did in
+                        [deck['id']] + self.col.decks.childDids(deck['id'], childMap)),
+                    max(0, rlim), self.reportLimit)
+                # save to list
+                data.append([deck['name'], deck['id'], rev, lrn, new])
+                # add deck as a parent
+                lims[deck['name']] = [nlim, rlim]
+            return data
 
     def deckDueTree(self):
         return self._groupChildren(self.deckDueList())
 
-    def _groupChildrenMain(self, grps):
-        tree = []
-        # group and recurse
-        def key(grp):
-            return grp[0][0]
-        for (head, tail) in itertools.groupby(grps, key=key):
-            tail = list(tail)
-            did = None
-            rev = 0
-            new = 0
-            lrn = 0
-            children = []
-            for c in tail:
-                if len(c[0]) == 1:
-                    # current node
-                    did = c[1]
-                    rev += c[2]
-                    lrn += c[3]
-                    new += c[4]
-                else:
-                    # set new string to tail
-                    c[0] = c[0][1:]
-                    children.append(c)
-            children = self._groupChildrenMain(children)
-            # tally up children counts
-            for ch in children:
-                lrn += ch[3]
-                new += ch[4]
-            # limit the counts to the deck's limits
-            conf = self.col.decks.confForDid(did)
-            deck = self.col.decks.get(did)
-            if not conf['dyn']:
-                new = max(0, min(new, conf['new']['perDay']-deck['newToday'][1]))
-            tree.append((head, did, rev, lrn, new, children))
-        return tuple(tree)
+    def _groupChildrenNode(self, head, did, rev, lrn, new, children):
+        """The node of deck did, whose own counts are rev, lrn and new:
+        the children's learning and new counts are added, then new is
+        capped by the deck's limit. rev already includes subdecks."""
+        # tally up children counts
+        for ch in children:
+            lrn += ch[3]
+            new += ch[4]
+        # limit the counts to the deck's limits
+        conf = self.col.decks.confForDid(did)
+        deck = self.col.decks.get(did)
+        if not conf['dyn']:
+            new = max(0, min(new, conf['new']['perDay']-deck['newToday'][1]))
+        return (head, did, rev, lrn, new, children)
 
     # Getting the next card
     ##########################################################################
@@ -220,16 +209,16 @@ class Scheduler(BothScheduler):
     # New cards
     ##########################################################################
 
-    def _deckNewLimitSingle(self, deck, sync=False):
+    def _deckNewLimitSingle(self, deck, sync=False, conf=None):
         """Limit for deck without parent limits.
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
+        conf -- the deck's conf, if the caller already has it
         """
         if deck['dyn']:
             return self.dynReportLimit
-        c = self.col.decks.confForDid(deck['id'])
+        c = conf or self.col.decks.confForDid(deck['id'])
         nbNewToSee = c['new']['perDay'] - deck['newToday'][1]
-        from aqt import mw
-        if (not sync) and mw and mw.pm.profile.get("limitAllCards", False):
+        if (not sync) and self._limitAllCards:
             nbCardToSee = c.get('perDay', 1000) - deck['revToday'][1] - deck['newToday'][1]
             lim = min(nbNewToSee, nbCardToSee)
         else:
@@ -252,21 +241,17 @@ class Scheduler(BothScheduler):
             self._resetLrn()
 
     def _resetLrnCount(self):
-        # sub-day
+        # sub-day, day and preview cards, counted in a single query as
+        # this runs every minute while reviewing
         self.lrnCount = self.col.db.scalar(f"""
-select count() from cards where did in %s and queue = {QUEUE_LRN}
-and due < ?""" %
+select
+  sum(queue = {QUEUE_LRN} and due < ?) +
+  sum(queue = {QUEUE_DAY_LRN} and due <= ?) +
+  sum(queue = {QUEUE_PREVIEW})
+from cards where did in %s
+and queue in ({QUEUE_LRN},{QUEUE_DAY_LRN},{QUEUE_PREVIEW})""" %
             self._deckLimit(),
-            self._lrnCutoff) or 0
-        # day
-        self.lrnCount += self.col.db.scalar(f"""
-select count() from cards where did in %s and queue = {QUEUE_DAY_LRN}
-and due <= ?""" % self._deckLimit(),
-                                            self.today)
-        # previews
-        self.lrnCount += self.col.db.scalar(f"""
-select count() from cards where did in %s and queue = {QUEUE_PREVIEW}
-""" % self._deckLimit())
+            self._lrnCutoff, self.today) or 0
 
     def _resetLrn(self):
         self._updateLrnCutoff(force=True)
@@ -349,7 +334,8 @@ select count() from cards where did in %s and queue = {QUEUE_PREVIEW}
         if delay is None:
             delay = self._delayForGrade(conf, card.left)
 
-        card.due = int(time.time() + delay)
+        now = time.time()
+        card.due = int(now + delay)
         # due today?
         if card.due < self.dayCutoff:
             # add some randomness, up to 5 minutes or 25%
@@ -357,7 +343,7 @@ select count() from cards where did in %s and queue = {QUEUE_PREVIEW}
             fuzz = random.randrange(0, maxExtra)
             card.due = min(self.dayCutoff-1, card.due + fuzz)
             card.queue = QUEUE_LRN
-            if card.due < (intTime() + self.col.conf['collapseTime']):
+            if card.due < (int(now) + self.col.conf['collapseTime']):
                 self.lrnCount += 1
                 # if the queue is not empty and there's nothing else to do, make
                 # sure we don't put it at the head of the queue and end up showing
@@ -447,6 +433,22 @@ select count() from
 and due <= ? limit ?)""",
             did, self.today, self.reportLimit)
 
+    def _lrnForDecks(self, dids):
+        """Map each deck of dids to its _lrnForDeck value, using one query
+        per learning queue rather than two queries per deck."""
+        counts = {}
+        for did, cnt in self.col.db.execute(f"""
+select did, count() from cards where did in %s
+and queue = {QUEUE_LRN} and due < ? group by did""" % ids2str(dids),
+                intTime() + self.col.conf['collapseTime']):
+            counts[did] = min(cnt, self.reportLimit)
+        for did, cnt in self.col.db.execute(f"""
+select did, count() from cards where did in %s
+and queue = {QUEUE_DAY_LRN} and due <= ? group by did""" % ids2str(dids),
+                self.today):
+            counts[did] = counts.get(did, 0) + min(cnt, self.reportLimit)
+        return counts
+
     # Reviews
     ##########################################################################
 
@@ -457,9 +459,10 @@ and due <= ? limit ?)""",
         deck = self.col.decks.get(self.col.decks.selected(), default=False)
         return self._deckRevLimitSingle(deck, sync=sync)
 
-    def _deckRevLimitSingle(self, deck, parentLimit=None, sync=False):
+    def _deckRevLimitSingle(self, deck, parentLimit=None, sync=False, conf=None):
         """
         sync -- whether it's called from sync, and the return must satisfies sync sanity check
+        conf -- the deck's conf, if the caller already has it
         """
         # invalid deck selected?
         if not deck:
@@ -468,10 +471,9 @@ and due <= ? limit ?)""",
         if deck['dyn']:
             return self.dynReportLimit
 
-        c = self.col.decks.confForDid(deck['id'])
+        c = conf or self.col.decks.confForDid(deck['id'])
         lim = max(0, c['rev']['perDay'] - deck['revToday'][1])
-        from aqt import mw
-        if (not sync) and mw and mw.pm.profile.get("limitAllCards", False):
+        if (not sync) and self._limitAllCards:
             nbCardToSee = c.get('perDay', 1000) - deck['revToday'][1] - deck['newToday'][1]
             lim = min(lim, nbCardToSee)
 
@@ -503,7 +505,7 @@ and due <= ? limit ?)""" % ids2str(dids),
         self.revCount = self.col.db.scalar(f"""
 select count() from (select id from cards where
 did in %s and queue = {QUEUE_REV} and due <= ? limit {lim})""" %
-                                           ids2str(self.col.decks.active()),
+                                           self._deckLimit(),
                                            self.today)
 
     def _fillRev(self):
@@ -518,7 +520,7 @@ did in %s and queue = {QUEUE_REV} and due <= ? limit {lim})""" %
 select id from cards where
 did in %s and queue = {QUEUE_REV} and due <= ?
 order by due
-limit ?""" % ids2str(self.col.decks.active()),
+limit ?""" % self._deckLimit(),
                     self.today, lim)
 
             if self._revQueue:
@@ -527,9 +529,7 @@ limit ?""" % ids2str(self.col.decks.active()),
                     self._revQueue.reverse()
                 else:
                     # fixme: as soon as a card is answered, this is no longer consistent
-                    r = random.Random()
-                    r.seed(self.today)
-                    r.shuffle(self._revQueue)
+                    random.Random(self.today).shuffle(self._revQueue)
                 return True
 
         if self.revCount:
@@ -596,18 +596,7 @@ limit ?""" % ids2str(self.col.decks.active()),
         self._removeFromFiltered(card)
 
     def _logRev(self, card, ease, delay, type):
-        def log():
-            self.col.db.execute(
-                "insert into revlog values (?,?,?,?,?,?,?,?,?)",
-                int(time.time()*1000), card.id, self.col.usn(), ease,
-                -delay or card.ivl, card.lastIvl, card.factor, card.timeTaken(),
-                type)
-        try:
-            log()
-        except:
-            # duplicate pk; retry in 10ms
-            time.sleep(0.01)
-            log()
+        self._insertRevlog(card, ease, -delay or card.ivl, card.lastIvl, type)
 
     # Interval management
     ##########################################################################
@@ -708,22 +697,16 @@ limit ?""" % ids2str(self.col.decks.active()),
     def emptyDyn(self, did, lim=None):
         if not lim:
             lim = "did = %s" % did
-        self.col.log(self.col.db.list("select id from cards where %s" % lim))
-
-        self.col.db.execute("""
-update cards set did = odid, %s,
-due = (case when odue>0 then odue else due end), odue = 0, odid = 0, usn = ? where %s""" % (
-            self._restoreQueueSnippet, lim),
-                            self.col.usn())
+        self._updateCardsWhere("""
+did = odid, %s,
+due = (case when odue>0 then odue else due end), odue = 0, odid = 0, usn = ?""" %
+            self._restoreQueueSnippet, lim, self.col.usn())
 
     def _moveToDyn(self, did, ids, start=-100000):
         deck = self.col.decks.get(did)
-        data = []
         u = self.col.usn()
-        due = start
-        for id in ids:
-            data.append((did, due, u, id))
-            due += 1
+        # executemany consumes the rows as they are generated
+        data = ((did, due, u, id) for due, id in enumerate(ids, start))
 
         queue = ""
         if not deck['resched']:
@@ -770,9 +753,7 @@ where id = ?
         if (card.lapses >= lf and
             (card.lapses-lf) % (max(lf // 2, 1)) == 0):
             # add a leech tag
-            f = card.note()
-            f.addTag("leech")
-            f.flush()
+            self._tagLeech(card)
             # handle
             a = conf['leechAction']
             if a == LEECH_SUSPEND:
@@ -807,17 +788,14 @@ where id = ?
             self.col.log(self.today, self.dayCutoff)
         # update all daily counts, but don't save decks to prevent needless
         # conflicts. we'll save on card answer instead
-        def update(deck):
-            for t in "new", "rev", "lrn", "time":
-                key = t+"Today"
-                if deck[key][0] != self.today:
-                    deck[key] = [self.today, 0]
-        for deck in self.col.decks.all():
-            update(deck)
+        self._rollDeckCounts()
         # unbury if the day has rolled over
         unburied = self.col.conf.get("lastUnburied", 0)
         if unburied < self.today:
-            self.unburyCards()
+            # an update matching nothing would still mark the db modified
+            if self.col.db.scalar(
+                    f"select 1 from cards where queue in ({QUEUE_USER_BURIED}, {QUEUE_SCHED_BURIED}) limit 1"):
+                self.unburyCards()
             self.col.conf['lastUnburied'] = self.today
 
     def _dayCutoff(self):
@@ -842,7 +820,7 @@ where id = ?
     ##########################################################################
 
     def haveManuallyBuried(self):
-        sdids = ids2str(self.col.decks.active())
+        sdids = self._deckLimit()
         cnt = self.col.db.scalar(
 
             f"select 1 from cards where queue = {QUEUE_SCHED_BURIED} and did in %s limit 1" % sdids)
@@ -854,6 +832,7 @@ where id = ?
     # Next time reports
     ##########################################################################
 
+    @withConfCache
     def nextIvl(self, card, ease):
         "Return the next interval for CARD, in seconds."
         # preview mode?
@@ -917,31 +896,30 @@ end)
     def suspendCards(self, ids):
         "Suspend cards."
         self.col.log(ids)
-        self.col.db.execute(
-            ("update cards set queue=%d,mod=?,usn=? where id in "%QUEUE_SUSPENDED)+
-            ids2str(ids), intTime(), self.col.usn())
+        self._updateCards(
+            f"update cards set queue={QUEUE_SUSPENDED},mod=?,usn=? where id in %s",
+            ids, intTime(), self.col.usn())
 
     def unsuspendCards(self, ids):
         "Unsuspend cards."
         self.col.log(ids)
-        self.col.db.execute(
-            ("update cards set %s,mod=?,usn=? "
-            f"where queue = {QUEUE_SUSPENDED} and id in %s") % (self._restoreQueueSnippet, ids2str(ids)),
-            intTime(), self.col.usn())
+        self._updateCards(
+            f"update cards set %s,mod=?,usn=? "
+            f"where queue = {QUEUE_SUSPENDED} and id in %%s" % self._restoreQueueSnippet,
+            ids, intTime(), self.col.usn())
 
     def buryCards(self, cids, manual=True):
         queue = manual and QUEUE_SCHED_BURIED or QUEUE_USER_BURIED
         self.col.log(cids)
-        self.col.db.execute("""
-update cards set queue=?,mod=?,usn=? where id in """+ids2str(cids),
-                            queue, intTime(), self.col.usn())
+        self._updateCards(
+            "update cards set queue=?,mod=?,usn=? where id in %s",
+            cids, queue, intTime(), self.col.usn())
 
     def unburyCards(self):
         "Unbury all buried cards in all decks."
-        self.col.log(
-            self.col.db.list(f"select id from cards where queue in ({QUEUE_USER_BURIED}, {QUEUE_SCHED_BURIED})"))
-        self.col.db.execute(
-            f"update cards set %s where queue in ({QUEUE_USER_BURIED}, {QUEUE_SCHED_BURIED})" % self._restoreQueueSnippet)
+        self._updateCardsWhere(
+            self._restoreQueueSnippet,
+            f"queue in ({QUEUE_USER_BURIED}, {QUEUE_SCHED_BURIED})")
 
     def unburyCardsForDeck(self, type="all"):
         if type == "all":
@@ -953,22 +931,16 @@ update cards set queue=?,mod=?,usn=? where id in """+ids2str(cids),
         else:
             raise Exception("unknown type")
 
-        sids = ids2str(self.col.decks.active())
-        self.col.log(
-            self.col.db.list("select id from cards where %s and did in %s"
-                             % (queue, sids)))
-        self.col.db.execute(
-            "update cards set mod=?,usn=?,%s where %s and did in %s"
-            % (self._restoreQueueSnippet, queue, sids), intTime(), self.col.usn())
+        self._updateCardsWhere(
+            "mod=?,usn=?,%s" % self._restoreQueueSnippet,
+            "%s and did in %s" % (queue, self._deckLimit()),
+            intTime(), self.col.usn())
 
     # Sibling spacing
     ##########################################################################
 
-    def _burySiblings(self, card):
-        toBury = super()._burySiblings(card)
-        # then bury
-        if toBury:
-            self.buryCards(toBury, manual=False)
+    def _buryAsSiblings(self, toBury):
+        self.buryCards(toBury, manual=False)
 
     # Changing scheduler versions
     ##########################################################################
@@ -1000,8 +972,10 @@ else type end),
     where queue in ({QUEUE_LRN},{QUEUE_DAY_LRN}) and type in ({CARD_DUE}, {CARD_FILTERED})
     """ % (self.today, intTime(), self.col.usn()))
         # remove new cards from learning
-        self.forgetCards(self.col.db.list(
-            f"select id from cards where queue in ({QUEUE_LRN}, {QUEUE_DAY_LRN})"))
+        nonRev = self.col.db.list(
+            f"select id from cards where queue in ({QUEUE_LRN}, {QUEUE_DAY_LRN})")
+        if nonRev:
+            self.forgetCards(nonRev)
 
     # v1 doesn't support buried/suspended (re)learning cards
     def _resetSuspendedLearning(self):
@@ -39,6 +39,9 @@ def Collection(path, lock=True, server=False, log=False):
     db.execute("pragma cache_size = 10000")
     if not isWin:
         db.execute("pragma journal_mode = wal")
+        # in wal mode this only gives up the last commits on power loss,
+        # and saves an fsync on every commit
+        db.execute("pragma synchronous = normal")
     db.setAutocommit(False)
     # add db to col and do any remaining upgrades
     col = _Collection(db, server, log)
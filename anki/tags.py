@@ -118,10 +118,11 @@ class TagManager:
                     for x, y in enumerate(newTags)]))
         # update tags
         nids = []
+        mod = intTime()
+        usn = self.col.usn()
         def fix(row):
             nids.append(row[0])
-            return {'id': row[0], 't': fn(tags, row[1]), 'n':intTime(),
-                'u':self.col.usn()}
+            return {'id': row[0], 't': fn(tags, row[1]), 'n':mod, 'u':usn}
         self.col.db.executemany(
             "update notes set tags=:t,mod=:n,usn=:u where id = :id",
             [fix(row) for row in res])
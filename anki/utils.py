@@ -217,6 +217,11 @@ def ids2str(ids):
     """Given a list of integers, return a string '(int1,int2,...)'."""
     return "(%s)" % ",".join(str(i) for i in ids)
 
+def chunkedIds(ids, size=500):
+    """Yield consecutive slices of the list ids, each of at most size ids."""
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
 def timestampID(db, table, t=None):
     """Return a non-conflicting timestamp for table. 
     
@@ -15,10 +15,9 @@ import json
 import re
 import zipfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import markdown
 from send2trash import send2trash
-import jsonschema
-from jsonschema.exceptions import ValidationError
 
 from aqt.qt import *
 from aqt.utils import showInfo, openFolder, isWin, openLink, \
@@ -27,7 +26,7 @@ from aqt.utils import showInfo, openFolder, isWin, openLink, \
 from zipfile import ZipFile
 import aqt.forms
 import aqt
-from aqt.downloader import download
+from aqt.downloader import downloadMany
 from anki.lang import _, ngettext
 from anki.utils import intTime
 from anki.sync import AnkiRequestsClient
@@ -53,10 +52,21 @@ class AddonManager:
         },
         "required": ["package", "name"]
     }
+    _manifestKeys = frozenset(_manifest_schema["properties"])
+    # the manifest keys which are copied into meta.json
+    _manifestMetaKeys = frozenset(
+        key for key, prop in _manifest_schema["properties"].items()
+        if prop["meta"])
 
     def __init__(self, mw):
         self.mw = mw
         self.dirty = False
+        # dir -> ((mtime, size) of the file, value read from it), for
+        # meta.json's text, config.json's text and config.md's html
+        self._metaCache = {}
+        self._defaultsCache = {}
+        self._helpCache = {}
+        self._addonsRoot = None
         f = self.mw.form
         f.actionAdd_ons.triggered.connect(self.onAddonsDialog)
         sys.path.insert(0, self.addonsFolder())
@@ -70,12 +80,12 @@ class AddonManager:
         A folder is an add-on folder iff it contains __init__.py.
 
         """
-        l = []
-        for d in os.listdir(self.addonsFolder()):
-            path = self.addonsFolder(d)
-            if not os.path.exists(os.path.join(path, "__init__.py")):
-                continue
-            l.append(d)
+        # is_dir() comes from the directory listing itself on most
+        # platforms, so plain files cost no extra stat
+        with os.scandir(self.addonsFolder()) as it:
+            l = [sys.intern(e.name) for e in it
+                 if e.is_dir() and
+                 os.path.exists(os.path.join(e.path, "__init__.py"))]
         l.sort()
         if os.getenv("ANKIREVADDONS", ""):
             l = reversed(l)
@@ -88,7 +98,7 @@ class AddonManager:
         Reverse order if the environment variable  ANKIREVADDONS is set.
         """
         return [d for d in self.allAddons()
-                if re.match(r"^\d+$", d)]
+                if d.isdecimal()]
 
     def addonsFolder(self, dir=None):
         """Path to a folder.
@@ -100,14 +110,16 @@ class AddonManager:
         dir -- TODO
         """
 
-        root = self.mw.pm.addonFolder()
         if not dir:
-            return root
-        return os.path.join(root, dir)
+            # pm.addonFolder() creates the folder if needed, which costs
+            # a stat; paths inside it don't need that guarantee
+            self._addonsRoot = self.mw.pm.addonFolder()
+            return self._addonsRoot
+        return os.path.join(self._addonsRoot or self.addonsFolder(), dir)
 
     def loadAddons(self):
         for dir in self.allAddons():
-            if dir in incorporatedAddonsDict or (re.match(r"^\d+$", dir) and int(dir) in incorporatedAddonsDict):
+            if dir in incorporatedAddonsDirs:
                 continue
             meta = self.addonMeta(dir)
             if meta.get("disabled"):
@@ -134,18 +146,51 @@ When loading '%(name)s':
         """Path of the configuration of the addon dir"""
         return os.path.join(self.addonsFolder(dir), "meta.json")
 
+    def _fileStamp(self, path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _readCached(self, cache, dir, path, convert=None):
+        """convert applied to the content of path, or the content itself.
+
+        The value is kept in cache[dir], and the file is read again only
+        if it changed on disk. Raises OSError if it can't be read."""
+        stamp = self._fileStamp(path)
+        entry = cache.get(dir)
+        if entry is None or entry[0] != stamp:
+            with open(path, encoding="utf8") as f:
+                text = f.read()
+            entry = (stamp, convert(text) if convert else text)
+            cache[dir] = entry
+        return entry[1]
+
+    def _forgetAddon(self, dir):
+        """Drop what is cached about the files of add-on dir."""
+        for cache in (self._metaCache, self._defaultsCache, self._helpCache):
+            cache.pop(dir, None)
+
     def addonMeta(self, dir):
+        """The content of meta.json of add-on dir, or {}.
+
+        The file is read again only if it changed on disk. A new dict is
+        returned on each call, callers are free to mutate it."""
         path = self._addonMetaPath(dir)
         try:
-            with open(path, encoding="utf8") as f:
-                return json.load(f)
+            return json.loads(self._readCached(self._metaCache, dir, path))
         except:
+            self._metaCache.pop(dir, None)
             return dict()
 
     def writeAddonMeta(self, dir, meta):
         path = self._addonMetaPath(dir)
-        with open(path, "w", encoding="utf8") as f:
-            json.dump(meta, f)
+        text = json.dumps(meta)
+        # write a copy and swap it in, so that a crash can't leave an
+        # empty or truncated meta.json
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w", encoding="utf8") as f:
+            f.write(text)
+        os.replace(tmpPath, path)
+        self._metaCache[dir] = (self._fileStamp(path), text)
 
     def isEnabled(self, dir):
         meta = self.addonMeta(dir)
@@ -155,7 +200,8 @@ When loading '%(name)s':
         meta = self.addonMeta(dir)
         enabled = enable if enable is not None else meta.get("disabled")
         if enabled is True:
-            conflicting = self._disableConflicting(dir)
+            conflicting = self._disableConflicting(
+                dir, meta.get("conflicts", []))
             if conflicting:
                 addons = ", ".join(self.addonName(f) for f in conflicting)
                 showInfo(
@@ -186,22 +232,31 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
     def addonConflicts(self, dir):
         return self.addonMeta(dir).get("conflicts", [])
 
-    def allAddonConflicts(self):
+    def _allAddonMetas(self):
+        """Dict from each installed add-on to its meta."""
+        return {dir: self.addonMeta(dir) for dir in self.allAddons()}
+
+    def allAddonConflicts(self, metas=None):
+        """Dict from add-on to the enabled add-ons declaring a conflict with it.
+
+        metas -- as returned by _allAddonMetas, loaded if not given"""
+        if metas is None:
+            metas = self._allAddonMetas()
         all_conflicts = defaultdict(list)
-        for dir in self.allAddons():
-            if not self.isEnabled(dir):
+        for dir, meta in metas.items():
+            if meta.get("disabled"):
                 continue
-            conflicts = self.addonConflicts(dir)
-            for other_dir in conflicts:
+            for other_dir in meta.get("conflicts", []):
                 all_conflicts[other_dir].append(dir)
         return all_conflicts
 
     def _disableConflicting(self, dir, conflicts=None):
         conflicts = conflicts or self.addonConflicts(dir)
 
-        installed = self.allAddons()
-        found = [d for d in conflicts if d in installed and self.isEnabled(d)]
-        found.extend(self.allAddonConflicts().get(dir, []))
+        metas = self._allAddonMetas()
+        found = [d for d in conflicts
+                 if d in metas and not metas[d].get("disabled")]
+        found.extend(self.allAddonConflicts(metas).get(dir, []))
         if not found:
             return []
 
@@ -213,15 +268,47 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
     # Installing and deleting add-ons
     ######################################################################
 
+    # python types of the json schema types used by _manifest_schema
+    _schemaTypes = {
+        "object": dict,
+        "array": list,
+        "string": str,
+        "number": (int, float),
+    }
+
+    def _checkSchemaType(self, value, schema):
+        """Raise ValueError unless value has the type of schema."""
+        expected = schema["type"]
+        # as in json schema, booleans are not numbers
+        if (not isinstance(value, self._schemaTypes[expected]) or
+                (expected == "number" and isinstance(value, bool))):
+            raise ValueError("expected {}: {!r}".format(expected, value))
+        if expected == "array":
+            for item in value:
+                self._checkSchemaType(item, schema["items"])
+
+    def _validateManifest(self, data):
+        """Raise ValueError unless data matches _manifest_schema.
+
+        Only handles the few constructs the schema uses, which is much
+        cheaper than having jsonschema interpret it."""
+        self._checkSchemaType(data, self._manifest_schema)
+        for key in self._manifest_schema["required"]:
+            if key not in data:
+                raise ValueError("missing key: {}".format(key))
+        for key, prop in self._manifest_schema["properties"].items():
+            if key in data:
+                self._checkSchemaType(data[key], prop)
+
     def readManifestFile(self, zfile):
         try:
             with zfile.open("manifest.json") as f:
                 data = json.loads(f.read())
-            jsonschema.validate(data, self._manifest_schema)
+            self._validateManifest(data)
             # build new manifest from recognized keys
-            schema = self._manifest_schema["properties"]
-            manifest = {key: data[key] for key in data.keys() & schema.keys()}
-        except (KeyError, json.decoder.JSONDecodeError, ValidationError):
+            manifest = {key: data[key]
+                        for key in self._manifestKeys.intersection(data)}
+        except (KeyError, ValueError):
             # raised for missing manifest, invalid json, missing/invalid keys
             return {}
         return manifest
@@ -248,15 +335,15 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
                                                        conflicts)
             meta = self.addonMeta(package)
             self._install(package, zfile)
-        schema = self._manifest_schema["properties"]
         manifest_meta = {k: v for k, v in manifest.items()
-                         if k in schema and schema[k]["meta"]}
+                         if k in self._manifestMetaKeys}
         meta.update(manifest_meta)
         self.writeAddonMeta(package, meta)
 
         return True, meta["name"], found_conflicts
 
     def _install(self, dir, zfile):
+        self._forgetAddon(dir)
         # previously installed?
         base = self.addonsFolder(dir)
         if os.path.exists(base):
@@ -268,20 +355,28 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
         os.mkdir(base)
         self.restoreUserFiles(dir)
 
+        # existing user files, as zip member names
+        userFiles = set()
+        for root, dirs, files in os.walk(self._userFilesPath(dir)):
+            rel = os.path.relpath(root, base).replace(os.sep, "/")
+            userFiles.update(rel + "/" + name for name in dirs + files)
+
         # extract
-        for n in zfile.namelist():
-            if n.endswith("/"):
+        for info in zfile.infolist():
+            if info.is_dir():
                 # folder; ignore
                 continue
 
-            path = os.path.join(base, n)
             # skip existing user files
-            if os.path.exists(path) and n.startswith("user_files/"):
+            if info.filename in userFiles:
                 continue
-            zfile.extract(n, base)
+            # extract() sanitizes the member's path, so that it can't
+            # escape base, and streams it with shutil.copyfileobj
+            zfile.extract(info, base)
 
     def deleteAddon(self, dir):
         """Delete the add-on folder of add-on dir. Returns True on success"""
+        self._forgetAddon(dir)
         try:
             send2trash(self.addonsFolder(dir))
             return True
@@ -325,8 +420,8 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
         log = []
         errs = []
         self.mw.progress.start(immediate=True)
-        for n in ids:
-            ret = download(self.mw, n)
+        # fetch concurrently, but install one after the other, in order
+        for n, ret in zip(ids, downloadMany(self.mw, ids)):
             if ret[0] == "error":
                 errs.append(_("Error downloading %(id)s: %(error)s") % dict(id=n, error=ret[1]))
                 continue
@@ -370,11 +465,15 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
                 if not meta.get("disabled"):
                     addons.append(dir)
 
-            mods = []
-            while addons:
-                chunk = addons[:25]
-                del addons[:25]
-                mods.extend(self._getModTimes(client, chunk))
+            chunks = [addons[i:i+25] for i in range(0, len(addons), 25)]
+            # the requests share the client's session, so connections
+            # are reused; map() reraises the first failing chunk's error
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                mods = []
+                for chunkMods in pool.map(
+                        lambda chunk: self._getModTimes(client, chunk),
+                        chunks):
+                    mods.extend(chunkMods)
             return self._updatedIds(mods)
         finally:
             self.mw.progress.finish()
@@ -394,10 +493,11 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
     def _updatedIds(self, mods):
         """Given a list of (id,last mod on server), returns the sublist of
         add-ons not up to date."""
+        addonMeta = self.addonMeta
         updated = []
         for dir, ts in mods:
             sid = str(dir)
-            if self.addonMeta(sid).get("mod", 0) < (ts or 0):
+            if addonMeta(sid).get("mod", 0) < (ts or 0):
                 updated.append(sid)
         return updated
 
@@ -419,23 +519,26 @@ and have been disabled: %(found)s") % dict(name=self.addonName(dir), found=addon
         This file should be called config.json"""
         path = os.path.join(self.addonsFolder(dir), "config.json")
         try:
-            with open(path, encoding="utf8") as f:
-                return json.load(f)
+            # parsed on each call, as getConfig updates the dict
+            return json.loads(
+                self._readCached(self._defaultsCache, dir, path))
         except:
+            self._defaultsCache.pop(dir, None)
             return None
 
     def addonConfigHelp(self, dir):
         """The configuration of this addon, obtained as configuration"""
         path = os.path.join(self.addonsFolder(dir), "config.md")
-        if os.path.exists(path):
-            with open(path, encoding="utf-8") as f:
-                return markdown.markdown(f.read())
-        else:
+        try:
+            return self._readCached(self._helpCache, dir, path,
+                                    markdown.markdown)
+        except FileNotFoundError:
+            self._helpCache.pop(dir, None)
             return ""
 
     def addonFromModule(self, module):
         """Returns the string of module before the first dot"""
-        return module.split(".")[0]
+        return module.partition(".")[0]
 
     def configAction(self, addon):
         """The function to call for addon when add-on manager ask for
@@ -606,26 +709,44 @@ class AddonsDialog(QDialog):
         addonList = self.form.addonList
         mgr = self.mgr
 
-        self.addons = [(mgr.annotatedName(d), d) for d in mgr.allAddons()]
-        self.addons.sort()
-
+        # read before self.addons, which maps rows to add-ons, changes
         selected = set(self.selectedAddons())
-        addonList.clear()
-        for name, dir in self.addons:
-            item = QListWidgetItem(name, addonList)
-            if not mgr.isEnabled(dir):
-                item.setForeground(Qt.gray)
-            if dir in selected:
-                item.setSelected(True)
 
-        addonList.repaint()
+        # one meta read per add-on, instead of one in annotatedName and
+        # one per isEnabled
+        addons = []
+        for dir in mgr.allAddons():
+            meta = mgr.addonMeta(dir)
+            name = meta.get("name", dir)
+            enabled = not meta.get("disabled")
+            if not enabled:
+                name += _(" (disabled)")
+            addons.append((name, dir, enabled))
+        addons.sort()
+        self.addons = [(name, dir) for name, dir, enabled in addons]
+
+        # fill the list without a layout pass and a signal per item
+        addonList.setUpdatesEnabled(False)
+        addonList.blockSignals(True)
+        try:
+            addonList.clear()
+            for name, dir, enabled in addons:
+                item = QListWidgetItem(name, addonList)
+                if not enabled:
+                    item.setForeground(Qt.gray)
+                if dir in selected:
+                    item.setSelected(True)
+        finally:
+            addonList.blockSignals(False)
+            addonList.setUpdatesEnabled(True)
+        self._onAddonItemSelected(addonList.currentRow())
 
     def _onAddonItemSelected(self, row_int):
         try:
             addon = self.addons[row_int][1]
         except IndexError:
             addon = ''
-        self.form.viewPage.setEnabled(bool(re.match(r"^\d+$", addon)))
+        self.form.viewPage.setEnabled(addon.isdecimal())
         self.form.config.setEnabled(bool(self.mgr.getConfig(addon) or
                                          self.mgr.configAction(addon)))
 
@@ -649,7 +770,7 @@ class AddonsDialog(QDialog):
         addon = self.onlyOneSelected()
         if not addon:
             return
-        if re.match(r"^\d+$", addon):
+        if addon.isdecimal():
             openLink(aqt.appShared + "info/{}".format(addon))
         else:
             showWarning(_("Add-on was not downloaded from AnkiWeb."))
@@ -806,32 +927,30 @@ class GetAddons(QDialog):
 # Editing config
 ######################################################################
 
+# a string literal (possibly unterminated), or an escaped character
+# outside of one
+_jsonTokenRe = re.compile(r'"(?:[^"\\]|\\.)*(?:"|\\?\Z)|\\.', re.S)
+_jsonEscapeRe = re.compile(r'\\(.)', re.S)
+
+def _unescapeNewline(m):
+    return "\n" if m.group(1) == "n" else m.group(0)
+
+def _readableToken(m):
+    token = m.group(0)
+    if token[0] != '"' or "\\n" not in token:
+        return token
+    return _jsonEscapeRe.sub(_unescapeNewline, token)
+
 def readableJson(text):
     """Text, where \n are replaced with new line. Unless it's preceded by a odd number of \."""
-    l=[]
-    numberOfSlashOdd=False
-    numberOfQuoteOdd=False
-    for char in text:
-        if char == "n" and numberOfQuoteOdd and numberOfSlashOdd:
-            l[-1]="\n"
-            debug("replacing last slash by newline")
-        else:
-            l.append(char)
-            if char=="\n":
-                char="newline"
-            debug(f"adding {char}")
-
-        if char == "\"":
-            if not numberOfSlashOdd:
-                numberOfQuoteOdd = not numberOfQuoteOdd
-                debug(f"numberOfQuoteOdd is now {numberOfQuoteOdd}")
-
-        if char == "\\":
-            numberOfSlashOdd = not numberOfSlashOdd
-        else:
-            numberOfSlashOdd = False
-        debug(f"numberOfSlashOdd is now {numberOfSlashOdd}")
-    return "".join(l)
+    if "\\n" not in text:
+        return text
+    return _jsonTokenRe.sub(_readableToken, text)
+
+def parseConfigText(text):
+    """The configuration written in text, as edited in ConfigEditor."""
+    # readableJson shows \n in strings as actual new lines
+    return json.loads(text, strict=False)
 
 
 
@@ -871,8 +990,11 @@ class ConfigEditor(QDialog):
             self.form.scrollArea.setVisible(False)
 
     def updateText(self, conf):
-        self.form.editor.setPlainText(
-            readableJson(json.dumps(conf,sort_keys=True,indent=4, separators=(',', ': '))))
+        # kept so that accept needs no parsing if the text wasn't edited
+        self._shownConf = conf
+        self._shownText = readableJson(
+            json.dumps(conf, sort_keys=True, indent=4))
+        self.form.editor.setPlainText(self._shownText)
 
     def onClose(self):
         saveGeom(self, "addonconf")
@@ -894,11 +1016,14 @@ class ConfigEditor(QDialog):
         -if the special config is falsy, just save the value
         """
         txt = self.form.editor.toPlainText()
-        try:
-            new_conf = json.loads(txt)
-        except Exception as e:
-            showInfo(_("Invalid configuration: ") + repr(e))
-            return
+        if txt == self._shownText:
+            new_conf = self._shownConf
+        else:
+            try:
+                new_conf = parseConfigText(txt)
+            except Exception as e:
+                showInfo(_("Invalid configuration: ") + repr(e))
+                return
 
         if not isinstance(new_conf, dict):
             showInfo(_("Invalid configuration: top level object must be a map"))
@@ -917,6 +1042,8 @@ class ConfigEditor(QDialog):
 ## Add-ons incorporated in this fork.
 
 class Addon:
+    __slots__ = ("name", "id", "mod", "gitHash", "gitRepo")
+
     def __init__(self, name = None, id = None, mod = None, gitHash = None, gitRepo = None):
         self.name = name
         self.id = id
@@ -924,16 +1051,21 @@ class Addon:
         self.gitHash = gitHash
         self.gitRepo = gitRepo
 
+    def __eq__(self, other):
+        if not isinstance(other, Addon):
+            return NotImplemented
+        return self.id == other.id and self.name == other.name
+
     def __hash__(self):
-        return self.id or hash(self.name)
+        return hash((self.id, self.name))
 
-""" Set of characteristic of Add-ons incorporated here"""
-incorporatedAddonsSet = {
+""" Characteristics of the add-ons incorporated here"""
+incorporatedAddonsList = (
     Addon("Add a tag to notes with missing media", 2027876532, 1560318502, "26c4f6158ce2b8811b8ac600ed8a0204f5934d0b", "Arthur-Milchior/anki-tag-missing-medias"),
     Addon("Adding note and changing note type become quicker", 802285486, gitHash = "f1b2df03f4040e7820454052a2088a7672d819b2", gitRepo = "https://github.com/Arthur-Milchior/anki-fast-note-type-editor"),
     Addon("Advanced note editor Multi-column Frozen fields", 2064123047, 1561905302, "82a27f2726598c25d06f3065d23eb988815efd25", "https://github.com/Arthur-Milchior/anki-Multi-column-edit-window"),
     Addon("Allows empty first field during adding and import", 46741504, 1553438887, "7224199", "https://github.com/Arthur-Milchior/anki-empty-first-field"),
-    Addon("Batch Editing", 291119185, 1560116344, "https://github.com/glutanimate/batch-editing", "41149dbec543b019a9eb01d06d2a3c5d13b8d830"),
+    Addon("Batch Editing", 291119185, 1560116344, "41149dbec543b019a9eb01d06d2a3c5d13b8d830", "https://github.com/glutanimate/batch-editing"),
     Addon("Change cards decks prefix", 1262882834, 1550534152, "f9843693dafb4aeb2248de5faf44cf5b5fdc69ec", "https://github.com/Arthur-Milchior/anki-deck-prefix-edit"),
     Addon("Change a notes type without requesting a database upload", 719871418, 1560313030, "8b97cfbea1b7d8bd7124d6ebe6553f36d1914823", "https://github.com/Arthur-Milchior/anki-change-note-type"),
     Addon("«Check database» Explain errors and what is done to fix it", 1135180054, gitHash = "371c360e5611ad3eec5dcef400d969e7b1572141", gitRepo = "https://github.com/Arthur-Milchior/anki-database-check-explained"), #mod unkwon because it's not directly used by the author anymore
@@ -956,7 +1088,16 @@ incorporatedAddonsSet = {
     Addon("Open Added Today from Reviewer", 861864770, 1561610680, gitRepo = "https://github.com/glutanimate/anki-addons-misc"), #repo contains many add-ons. Thus hash seems useless. 47a218b21314f4ed7dd62397945c18fdfdfdff71
     Addon("Opening the same window multiple time", 354407385, 1545364194, "c832579f6ac7b327e16e6dfebcc513c1e89a693f", "https://github.com/Arthur-Milchior/anki-Multiple-Windows"),
     Addon("Postpone cards review", 1152543397, 1560126139, "27103fd69c19e0576c5df6e28b5687a8a3e3d905", "https://github.com/Arthur-Milchior/Anki-postpone-reviews"),
-}
-
-incorporatedAddonsDict = {**{addon.name: addon for addon in incorporatedAddonsSet if addon.name},
-                          **{addon.id: addon for addon in incorporatedAddonsSet if addon.id}}
+)
+
+"""Dict from the names and the ids of incorporated add-ons to them."""
+incorporatedAddonsDict = {}
+for addon in incorporatedAddonsList:
+    if addon.name:
+        incorporatedAddonsDict[addon.name] = addon
+    if addon.id:
+        incorporatedAddonsDict[addon.id] = addon
+del addon
+"""Folder names of the add-ons incorporated here, i.e. their names and
+their ids as strings."""
+incorporatedAddonsDirs = frozenset(str(key) for key in incorporatedAddonsDict)
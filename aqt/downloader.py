@@ -4,7 +4,7 @@
 
 """Everything required to download an add-on, when we already have the number."""
 
-import time, re, traceback
+import time, re, traceback, threading, collections
 from aqt.qt import *
 from anki.sync import AnkiRequestsClient
 from anki.hooks import addHook, remHook
@@ -16,27 +16,59 @@ def download(mw, code):
     from  ankiweb. Or a pair with "error" and the error code.
 
     Caller must start & stop progress diag."""
-    # create downloading thread
-    thread = Downloader(code)
+    return downloadMany(mw, [code])[0]
+
+def downloadMany(mw, codes, maxThreads=4):
+    """The list of download's results for each code, in the same order.
+
+    At most maxThreads add-ons are downloaded at once.
+
+    Caller must start & stop progress diag."""
+    threads = [Downloader(code) for code in codes]
+    waiting = collections.deque(threads)
+    running = []
     done = False
+    # a single hook for all threads, registered here rather than by each
+    # thread, so that no thread changes the hook list while another one
+    # runs it
+    def recvEvent(bytes):
+        ident = threading.get_ident()
+        for thread in running:
+            if thread.threadId == ident:
+                thread.recvTotal += bytes
+                thread.recv.emit()
+                return
     def onRecv():
         if done:
             return
-        mw.progress.update(label="%dKB downloaded" % (thread.recvTotal/1024))
-    thread.recv.connect(onRecv)
-    thread.start()
-    while not thread.isFinished():
-        mw.app.processEvents()
-        thread.wait(100)
+        total = sum(thread.recvTotal for thread in threads)
+        mw.progress.update(label="%dKB downloaded" % (total/1024))
+    addHook("httpRecv", recvEvent)
+    try:
+        while waiting or running:
+            while waiting and len(running) < maxThreads:
+                thread = waiting.popleft()
+                thread.recv.connect(onRecv)
+                # a new list, as recvEvent may be iterating the old one
+                running = running + [thread]
+                thread.start()
+            mw.app.processEvents()
+            running[0].wait(100)
+            running = [thread for thread in running if not thread.isFinished()]
+    finally:
+        remHook("httpRecv", recvEvent)
 
     # make sure any posted events don't fire after we return
     done = True
 
-    if not thread.error:
-        # success
-        return thread.data, thread.fname
-    else:
-        return "error", thread.error
+    results = []
+    for thread in threads:
+        if not thread.error:
+            # success
+            results.append((thread.data, thread.fname))
+        else:
+            results.append(("error", thread.error))
+    return results
 
 class Downloader(QThread):
     """Class used to download add-on. Initialized with add-on number.
@@ -49,15 +81,15 @@ class Downloader(QThread):
         QThread.__init__(self)
         self.code = code
         self.error = None
+        self.recvTotal = 0
+        # set by run, to tell this thread's httpRecv events apart
+        self.threadId = None
 
     def run(self):
         # setup progress handler
         self.byteUpdate = time.time()
         self.recvTotal = 0
-        def recvEvent(bytes):
-            self.recvTotal += bytes
-            self.recv.emit()
-        addHook("httpRecv", recvEvent)
+        self.threadId = threading.get_ident()
         client = AnkiRequestsClient()
         try:
             resp = client.get(
@@ -73,8 +105,6 @@ class Downloader(QThread):
         except Exception as e:
             self.error = _("Please check your internet connection.") + "\n\n" + str(e)
             return
-        finally:
-            remHook("httpRecv", recvEvent)
 
         self.fname = re.match("attachment; filename=(.+)",
                               resp.headers['content-disposition']).group(1)
@@ -3,6 +3,8 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
 import datetime
+import inspect
+import io
 import re
 import signal
 import zipfile
@@ -10,21 +12,23 @@ import gc
 import time
 import faulthandler
 import platform
-from threading import Thread
+import shutil
+import tempfile
+from collections import defaultdict
+from threading import Thread, Lock
 
 from send2trash import send2trash
 from aqt.qt import *
 from anki import Collection
+from anki.db import sqlite
 from anki.utils import  isWin, isMac, intTime, splitFields, ids2str, \
         devMode
-from anki.hooks import runHook, addHook, runFilter
+from anki.hooks import runHook, addHook, runFilter, hookCount
 import aqt
 import aqt.progress
 import aqt.webview
 import aqt.toolbar
-import aqt.stats
 import aqt.mediasrv
-from anki.find import Finder
 import anki.sound
 import anki.mpv
 import csv
@@ -34,6 +38,21 @@ from aqt.utils import saveGeom, restoreGeom, showInfo, showWarning, \
 from aqt.qt import sip
 from anki.lang import _, ngettext
 
+# recent backups, as opposed to daily, monthly and yearly ones
+_recentBackupRe = re.compile(r"backup-\d{4}-\d{2}-.+\.colpkg")
+# copies of the collection that BackupThread compresses
+_backupSnapshotPrefix = "backup-tmp-"
+
+# menu texts with a trailing accelerator, such as "Browse(&B)"
+_accelRe = re.compile(r"^(.+)\(&.+\)(.+)?")
+
+# send2trash 1.8+ trashes a list of paths in one platform call. Older
+# versions name their argument path; the packaged builds carry no version
+# metadata, so the signature tells them apart
+_send2trashTakesList = "paths" in inspect.signature(send2trash).parameters
+
+_videoExts = frozenset((".mp4", ".mov", ".mpg", ".mpeg", ".mkv", ".avi"))
+
 """
 self.stateShortcuts -- the list of QShortcut elements due to the actual state of the main window (i.e. reviewer or overwiew).
 """
@@ -86,6 +105,8 @@ class AnkiQt(QMainWindow):
 
     def setupUI(self):
         self.col = None
+        # undo name currently shown in the menu
+        self._lastUndoName = None
         self.setupCrashLog()
         self.disableGC()
         self.setupAppMsg()
@@ -104,6 +125,7 @@ class AnkiQt(QMainWindow):
         self.setupAutoUpdate()
         self.setupHooks()
         self.setupRefreshTimer()
+        self.setupGCTimer()
         self.updateTitleBar()
         # screens
         self.setupDeckBrowser()
@@ -113,7 +135,11 @@ class AnkiQt(QMainWindow):
     def setupProfileAfterWebviewsLoaded(self):
         for w in (self.web, self.bottomWeb):
             if not w._domDone:
-                self.progress.timer(10, self.setupProfileAfterWebviewsLoaded, False, requiresCollection=False)
+                # check again once it's ready, from a timer as before
+                # rather than from within the bridge command
+                w.onDomDone(lambda: self.progress.timer(
+                    10, self.setupProfileAfterWebviewsLoaded, False,
+                    requiresCollection=False))
                 return
             else:
                 w.requiresCol = True
@@ -196,13 +222,16 @@ class AnkiQt(QMainWindow):
         if n < 0:
             # called on .clear()
             return
-        name = self.pm.profiles()[n]
-        f = self.profileForm
+        # the list holds the names refreshProfilesList got from pm
+        name = self.profileForm.profiles.item(n).text()
         self.pm.load(name)
 
     def openProfile(self):
-        name = self.pm.profiles()[self.profileForm.profiles.currentRow()]
-        return self.pm.load(name)
+        item = self.profileForm.profiles.currentItem()
+        if item is None:
+            # no profile selected
+            return
+        return self.pm.load(item.text())
 
     def onOpenProfile(self):
         self.loadProfile(self.profileDiag.closeWithoutQuitting)
@@ -414,7 +443,7 @@ Debug info:
         try:
             self.maybeOptimize()
             if not devMode:
-                corrupt = self.col.db.scalar("pragma integrity_check") != "ok"
+                corrupt = not self._checkIntegrity()
         except:
             corrupt = True
         try:
@@ -434,31 +463,96 @@ from the profile screen."))
 
         self.progress.finish()
 
+    def _checkIntegrity(self):
+        """Whether the collection passes sqlite's integrity check.
+
+        The check reads the whole file. It runs on its own connection in
+        a thread, so that the progress dialog is updated meanwhile."""
+        self.col.save()
+        path = self.col.path
+        result = []
+        def check():
+            db = sqlite.connect(path, timeout=60)
+            try:
+                result.append(db.execute("pragma integrity_check").fetchone()[0])
+            finally:
+                db.close()
+        thread = Thread(target=check)
+        thread.start()
+        while thread.is_alive():
+            self.app.processEvents()
+            thread.join(0.1)
+        return result == ["ok"]
+
     # Backup and auto-optimize
     ##########################################################################
 
     class BackupThread(Thread):
-        def __init__(self, path, data):
+        """Write the backups in paths from the collection copied in
+        snapshot, then delete the snapshot."""
+        # deflate level of the collection. Backups are written at each
+        # close; 1 is several times faster than the default 6 and only
+        # slightly bigger
+        compressLevel = 1
+        # backups started in quick succession (e.g. switching profiles)
+        # are written one at a time rather than competing for the disk
+        _writeLock = Lock()
+        # zlib and crc32 release the GIL while working on a chunk; big
+        # chunks keep the GUI thread running and cut per-call overhead
+        _chunkSize = 1024*1024
+        # snapshots not yet deleted by their thread
+        activeSnapshots = set()
+
+        def __init__(self, paths, snapshot):
             Thread.__init__(self)
-            self.path = path
-            self.data = data
-            # create the file in calling thread to ensure the same
+            self.paths = paths
+            self.snapshot = snapshot
+            self.activeSnapshots.add(os.path.abspath(snapshot))
+            # create the files in calling thread to ensure the same
             # file is not created twice
-            open(self.path, "wb").close()
+            for path in self.paths:
+                open(path, "wb").close()
 
         def run(self):
-            z = zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED)
-            z.writestr("collection.anki2", self.data)
-            z.writestr("media", "{}")
-            z.close()
+            with self._writeLock:
+                self._write()
+
+        def _write(self):
+            first, *others = self.paths
+            try:
+                if sys.version_info >= (3, 7):
+                    z = zipfile.ZipFile(first, "w", zipfile.ZIP_DEFLATED,
+                                        compresslevel=self.compressLevel)
+                else:
+                    z = zipfile.ZipFile(first, "w", zipfile.ZIP_DEFLATED)
+                # streamed from disk, the collection is not held in memory
+                size = os.path.getsize(self.snapshot)
+                with open(self.snapshot, "rb") as src, z.open(
+                        "collection.anki2", "w",
+                        force_zip64=size * 1.05 > zipfile.ZIP64_LIMIT) as dst:
+                    shutil.copyfileobj(src, dst, self._chunkSize)
+                z.writestr("media", "{}", compress_type=zipfile.ZIP_STORED)
+                z.close()
+            finally:
+                os.unlink(self.snapshot)
+                self.activeSnapshots.discard(os.path.abspath(self.snapshot))
+            # the other backups have the same content; compress it once
+            for path in others:
+                try:
+                    os.unlink(path)
+                    os.link(first, path)
+                except OSError:
+                    # e.g. file system without hard links
+                    shutil.copyfile(first, path)
 
     def backup(self):
         if devMode:
             return
-        currentTime = time.localtime(time.time())
-        self.year = int(time.strftime("%Y",currentTime))
-        self.month = int(time.strftime("%m",currentTime))
-        self.day = int(time.strftime("%d",currentTime))
+        today = datetime.date.today()
+        self.year = today.year
+        self.month = today.month
+        self.day = today.day
+        self.cleanBackupSnapshots()
         self.createBackups()
         self.cleanRecentBackup()
         self.cleanLongTermBackup()
@@ -467,21 +561,54 @@ from the profile screen."))
         dir = self.pm.backupFolder()
         path = self.pm.collectionPath()
 
-        localTime = time.localtime(time.time())
-        patternsToCreate = {"backup-%Y-%m-%d-%H.%M.%S.colpkg"}
+        t = time.localtime(time.time())
+        # distinct prefixes, no duplicates
+        filesToCreate = [f"backup-{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}-"
+                         f"{t.tm_hour:02d}.{t.tm_min:02d}.{t.tm_sec:02d}.colpkg"]
         if self.pm.profile.get('longTermBackup', True):
-            patternsToCreate.update({f"backup-yearly-{self.year:02d}.colpkg",
-                                     f"backup-monthly-{self.year:02d}-{self.month:02d}.colpkg",
-                                     f"backup-daily-{self.year:02d}-{self.month:02d}-{self.day:02d}.colpkg",})
-        filesToCreate = {time.strftime(pattern, localTime) for pattern in patternsToCreate}
-        with open(path, "rb") as f:
-            data = f.read()
+            filesToCreate += [f"backup-yearly-{self.year:04d}.colpkg",
+                              f"backup-monthly-{self.year:04d}-{self.month:02d}.colpkg",
+                              f"backup-daily-{self.year:04d}-{self.month:02d}-{self.day:02d}.colpkg"]
+        with os.scandir(dir) as it:
+            existing = frozenset(entry.name for entry in it)
+        newpaths = []
         for fname in filesToCreate:
-            newpath = os.path.join(dir, fname)
-            if not os.path.exists(newpath):
+            if fname not in existing:
+                newpath = os.path.join(dir, fname)
                 print(f"Making backup to {newpath}")
-                b = self.BackupThread(newpath, data)
-                b.start()
+                newpaths.append(newpath)
+        if not newpaths:
+            return
+        # the collection may be reopened or synced as soon as we return,
+        # so the thread works from a copy, made here by the OS instead
+        # of reading the whole file into memory
+        fd, snapshot = tempfile.mkstemp(
+            prefix=_backupSnapshotPrefix, suffix=".anki2", dir=dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(path, snapshot)
+        except:
+            os.unlink(snapshot)
+            raise
+        b = self.BackupThread(newpaths, snapshot)
+        b.start()
+
+    def cleanBackupSnapshots(self):
+        """Delete the collection copies left in the backup folder by a
+        backup which was interrupted, e.g. by a crash."""
+        dir = self.pm.backupFolder()
+        active = self.BackupThread.activeSnapshots
+        with os.scandir(dir) as it:
+            for entry in it:
+                if (entry.name.startswith(_backupSnapshotPrefix) and
+                        os.path.abspath(entry.path) not in active and
+                        entry.is_file()):
+                    print(f"deleting backup snapshot {entry.path}")
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        # its thread just finished
+                        pass
 
     def cleanRecentBackup(self):
         nbacks = self.pm.profile['numBackups']
@@ -489,12 +616,11 @@ from the profile screen."))
             return
         dir = self.pm.backupFolder()
 
-        # find existing backups
-        backups = []
-        for file in os.listdir(dir):
-            # only look for new-style format
-            if re.match(r"backup-\d{4}-\d{2}-.+.colpkg", file):
-                backups.append(file)
+        # find existing backups, only looking for new-style format
+        with os.scandir(dir) as it:
+            backups = [entry.name for entry in it
+                       if _recentBackupRe.match(entry.name) and
+                       entry.is_file()]
         backups.sort()
 
         # remove old ones
@@ -529,11 +655,15 @@ from the profile screen."))
         filesToKeep = ([f"backup-monthly-{yearToHave:02d}-{monthToHave:02d}.colpkg" for yearToHave, monthToHave in monthsToKeep]+
                        [f"backup-daily-{yearToHave:02d}-{monthToHave:02d}-{dayToHave:02d}.colpkg" for yearToHave, monthToHave, dayToHave in daysToKeep])
         print(filesToKeep)
-        for file in os.listdir(dir):
-            if (file.startswith("backup-monthy-") or file.startswith("backup-daily-")) and file not in filesToKeep:
-                oldpath = os.path.join(dir, file)
-                print(f"deleting backup {oldpath}")
-                os.unlink(oldpath)
+        filesToKeep = frozenset(filesToKeep)
+        with os.scandir(dir) as it:
+            for entry in it:
+                file = entry.name
+                if (file.startswith(("backup-monthly-", "backup-daily-")) and
+                        file not in filesToKeep and entry.is_file()):
+                    oldpath = entry.path
+                    print(f"deleting backup {oldpath}")
+                    os.unlink(oldpath)
 
 
 
@@ -846,7 +976,8 @@ QTreeWidget {
         # allow users to extend styling
         p = os.path.join(aqt.mw.pm.base, "style.css")
         if os.path.exists(p):
-            buf += open(p).read()
+            with open(p) as f:
+                buf += f.read()
 
         self.app.setStyleSheet(buf)
 
@@ -937,9 +1068,13 @@ QTreeWidget {
 
     def maybeEnableUndo(self):
         """Enable undo in the GUI if something can be undone. Call the hook undoState(somethingCanBeUndone)."""
-        if self.col and self.col.undoName():#Whether something can be undone
-            self.form.actionUndo.setText(_("Undo %s") %
-                                            self.col.undoName())
+        name = self.col.undoName() if self.col else None
+        if name == self._lastUndoName:
+            # menu and undoState listeners are already up to date
+            return
+        self._lastUndoName = name
+        if name:#Whether something can be undone
+            self.form.actionUndo.setText(_("Undo %s") % name)
             self.form.actionUndo.setEnabled(True)
             runHook("undoState", True)
         else:
@@ -952,10 +1087,11 @@ QTreeWidget {
         self.maybeEnableUndo()
 
     def autosave(self):
-        saved = self.col.autosave()
-        self.maybeEnableUndo()
-        if saved:
-            self.doGC()
+        if self.col.autosave():
+            self.maybeEnableUndo()
+            # only the objects created since the last collection; older
+            # ones are collected by gcWindow and setupGCTimer
+            self.doGC(1)
 
     # Other menu operations
     ##########################################################################
@@ -1053,10 +1189,11 @@ QTreeWidget {
         if not search:
             if not deck['dyn']:
                 search = 'deck:"%s" ' % deck['name']
-        decks = self.col.decks.allNames()
-        while _("Filtered Deck %d") % n in decks:
+        decks = set(self.col.decks.allNames())
+        template = _("Filtered Deck %d")
+        while template % n in decks:
             n += 1
-        name = _("Filtered Deck %d") % n
+        name = template % n
         did = self.col.decks.newDyn(name)
         diag = aqt.dyndeckconf.DeckConf(self, first=True, search=search)
         if not diag.ok:
@@ -1162,8 +1299,8 @@ Invalid property found on card. Please use Tools>Check Database, \
 and if the problem comes up again, please ask on the support site."""))
 
     def _isVideo(self, file):
-        head, ext = os.path.splitext(file.lower())
-        return ext in (".mp4", ".mov", ".mpg", ".mpeg", ".mkv", ".avi")
+        i = file.rfind(".")
+        return i >= 0 and file[i:].lower() in _videoExts
 
     def onMpvWillPlay(self, file):
         if not self._isVideo(file):
@@ -1189,15 +1326,18 @@ and if the problem comes up again, please ask on the support site."""))
         """
         path = os.path.join(self.pm.profileFolder(), "deleted_long.txt")
         existed = os.path.exists(path)
-        with open(path, "a", newline = '') as f:
+        # the notes are deleted together; log them with the same time
+        now = str(intTime())
+        humanNow = str(datetime.datetime.now())
+        rows = [[reason, now, humanNow, str(id), str(mid)] + splitFields(flds)
+                for id, mid, flds in col.db.execute(
+                    "select id, mid, flds from notes where id in %s" %
+                    ids2str(nids))]
+        with open(path, "a", newline = '', buffering=1024*1024) as f:
             writer = csv.writer(f)
             if not existed:
                 f.write("reason\tdeletion time id\thuman deletion time\tid\tmid\tfields\t\n")#difference: more fields
-            for id, mid, flds in col.db.execute(
-                    "select id, mid, flds from notes where id in %s" %
-                ids2str(nids)):
-                fields = splitFields(flds)
-                writer.writerow([reason,str(intTime()),str(datetime.datetime.now()),str(id), str(mid)]+fields)
+            writer.writerows(rows)
 
     # Schema modifications
     ##########################################################################
@@ -1225,14 +1365,18 @@ will be lost. Continue?"""))
 
         # if an error has directed the user to check the database,
         # silently clean up any broken reset hooks which distract from
-        # the underlying issue
-        while True:
+        # the underlying issue. runHook removes a hook that raises, so
+        # each retry has one broken hook less; an error surviving all
+        # retries does not come from a hook and is raised.
+        attempts = hookCount("reset") + 1
+        for attempt in range(attempts):
             try:
                 self.reset()
                 break
             except Exception as e:
+                if attempt == attempts - 1:
+                    raise
                 print("swallowed exception in reset hook:", e)
-                continue
         return ret
 
     def onCheckMediaDB(self):
@@ -1240,21 +1384,18 @@ will be lost. Continue?"""))
         (nohave, unused, warnings) = self.col.media.check()
         #self.progress.finish()
         # generate report
-        report = ""
+        sections = []
         if warnings:
-            report += "\n".join(warnings) + "\n"
+            sections.append("\n".join(warnings) + "\n")
         if unused:
-            if report:
-                report += "\n\n\n"
-            report += _(
-                "In media folder but not used by any cards:")
-            report += "\n" + "\n".join(unused)
+            sections.append(_(
+                "In media folder but not used by any cards:") +
+                "\n" + "\n".join(unused))
         if nohave:
-            if report:
-                report += "\n\n\n"
-            report += _(
-                "Used on cards but missing from media folder:")
-            report += "\n" + "\n".join(nohave)
+            sections.append(_(
+                "Used on cards but missing from media folder:") +
+                "\n" + "\n".join(nohave))
+        report = "\n\n\n".join(sections)
         if not report:
             tooltip(_("No unused or missing files found."))
             return
@@ -1288,9 +1429,12 @@ will be lost. Continue?"""))
             _("Delete unused media?")):
             return
         mdir = self.col.media.dir()
-        for f in unused:
-            path = os.path.join(mdir, f)
-            if os.path.exists(path):
+        paths = [os.path.join(mdir, f) for f in unused]
+        paths = [path for path in paths if os.path.exists(path)]
+        if _send2trashTakesList:
+            send2trash(paths)
+        else:
+            for path in paths:
                 send2trash(path)
         tooltip(_("Deleted."))
         diag.close()
@@ -1337,38 +1481,40 @@ will be lost. Continue?"""))
             self.col.remCards(cids)
             tooltip(ngettext("%d card deleted.", "%d cards deleted.", len(cids)) % len(cids))
             self.reset()
+            return
 
         # Create a dic associating to each nid the cids to delete.
-        nidToCidsToDelete = dict()
-        for cid in cids:
-            card = self.col.getCard(cid)
-            note = card.note()
-            nid = note.id
-            if nid not in nidToCidsToDelete:
-                nidToCidsToDelete[nid] = set()
+        nidToCidsToDelete = defaultdict(set)
+        for cid, nid in self.col.db.execute(
+                "select id, nid from cards where id in %s" % ids2str(cids)):
             nidToCidsToDelete[nid].add(cid)
 
+        # And to each of those nids all of its cids.
+        nidToCids = defaultdict(set)
+        for nid, cid in self.col.db.execute(
+                "select nid, id from cards where nid in %s" %
+                ids2str(nidToCidsToDelete)):
+            nidToCids[nid].add(cid)
+
         # Compute the set of empty notes. Keep their cards
         emptyNids = set()
         for nid, cidsToDeleteOfNote in nidToCidsToDelete.items():
-            note = self.col.getNote(nid)
-            cidsOfNids = set([card.id for card in note.cards()])
+            cidsOfNids = nidToCids[nid]
             if cidsOfNids == cidsToDeleteOfNote:
-                emptyNids.add(note.id)
+                emptyNids.add(nid)
                 cids -= cidsOfNids
 
         self.col.remCards(cids, notes = False)
 
         # Deal with tags
-        nidsWithTag = set(self.col.findNotes("tag:NoteWithNoCard"))
-        for nid in emptyNids - nidsWithTag:
-            note = self.col.getNote(nid)
-            note.addTag("NoteWithNoCard")
-            note.flush()
-        for nid in nidsWithTag - emptyNids:
-            note = self.col.getNote(nid)
-            note.delTag("NoteWithNoCard")
-            note.flush()
+        nidsWithTag = set(self.col.db.list(
+            "select id from notes where tags like '% NoteWithNoCard %'"))
+        toTag = emptyNids - nidsWithTag
+        if toTag:
+            self.col.tags.bulkAdd(list(toTag), "NoteWithNoCard")
+        toUntag = nidsWithTag - emptyNids
+        if toUntag:
+            self.col.tags.bulkRem(list(toUntag), "NoteWithNoCard")
 
         # Warn about notes without cards.
         if emptyNids:
@@ -1401,17 +1547,12 @@ will be lost. Continue?"""))
         d.show()
 
     def _captureOutput(self, on):
-        mw = self
-        class Stream:
-            def write(self, data):
-                mw._output += data
         if on:
-            self._output = ""
+            self._output = io.StringIO()
             self._oldStderr = sys.stderr
             self._oldStdout = sys.stdout
-            s = Stream()
-            sys.stderr = s
-            sys.stdout = s
+            sys.stderr = self._output
+            sys.stdout = self._output
         else:
             sys.stderr = self._oldStderr
             sys.stdout = self._oldStdout
@@ -1447,7 +1588,7 @@ will be lost. Continue?"""))
             # pylint: disable=exec-used
             exec(text)
         except:
-            self._output += traceback.format_exc()
+            self._output.write(traceback.format_exc())
         self._captureOutput(False)
         buf = ""
         for c, line in enumerate(text.strip().split("\n")):
@@ -1456,7 +1597,7 @@ will be lost. Continue?"""))
             else:
                 buf += "... %s\n" % line
         try:
-            frm.log.appendPlainText(buf + (self._output or "<no output>"))
+            frm.log.appendPlainText(buf + (self._output.getvalue() or "<no output>"))
         except UnicodeDecodeError:
             frm.log.appendPlainText(_("<non-unicode text>"))
         frm.log.ensureCursorVisible()
@@ -1485,7 +1626,7 @@ will be lost. Continue?"""))
         tgt = tgt or self
         for action in tgt.findChildren(QAction):
             txt = str(action.text())
-            m = re.match(r"^(.+)\(&.+\)(.+)?", txt)
+            m = _accelRe.match(txt)
             if m:
                 action.setText(m.group(1) + (m.group(2) or ""))
 
@@ -1546,13 +1687,21 @@ Please ensure a profile is open and Anki is not busy, then try again."""),
         obj.deleteLater()
         self.progress.timer(1000, self.doGC, False, requiresCollection=False)
 
+    def setupGCTimer(self):
+        # every 15 minutes, a full collection; autosave only collects the
+        # young generations, and a session may never close a window
+        self.progress.timer(15*60*1000, self.doGC, True,
+                            requiresCollection=False)
+
     def disableGC(self):
         gc.collect()
         gc.disable()
 
-    def doGC(self):
+    def doGC(self, generation=2):
+        """Collect garbage up to generation. Automatic collection is
+        disabled, so only collections asked for here ever run."""
         assert not self.progress.inDB
-        gc.collect()
+        gc.collect(generation)
 
     # Crash log
     ##########################################################################
@@ -1568,9 +1717,17 @@ Please ensure a profile is open and Anki is not busy, then try again."""),
     def setupMediaServer(self):
         self.mediaServer = aqt.mediasrv.MediaServer(self)
         self.mediaServer.start()
+        # filled on first use, as the port is only known once the server
+        # thread is ready
+        self._serverURL = None
+        self._baseHTML = None
 
     def baseHTML(self):
-        return '<base href="%s">' % self.serverURL()
+        if self._baseHTML is None:
+            self._baseHTML = '<base href="%s">' % self.serverURL()
+        return self._baseHTML
 
     def serverURL(self):
-        return "http://127.0.0.1:%d/" % self.mediaServer.getPort()
+        if self._serverURL is None:
+            self._serverURL = "http://127.0.0.1:%d/" % self.mediaServer.getPort()
+        return self._serverURL
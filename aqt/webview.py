@@ -99,6 +99,7 @@ class AnkiWebView(QWebEngineView):
 
         self._domDone = True
         self._pendingActions = []
+        self._domDoneCallbacks = []
         self.requiresCol = True
         self.setPage(self._page)
 
@@ -345,6 +346,11 @@ body {{ zoom: {}; background: {}; {} }}
         self._pendingActions.append((name, args))
         self._maybeRunActions()
 
+    def onDomDone(self, callback):
+        """Call callback, without argument, when the page next reports its
+        DOM is ready."""
+        self._domDoneCallbacks.append(callback)
+
     def _maybeRunActions(self):
         """Do the actions of pending actions, while _domDone"""
         while self._pendingActions and self._domDone:
@@ -382,6 +388,9 @@ body {{ zoom: {}; background: {}; {} }}
         if cmd == "domDone":
             self._domDone = True
             self._maybeRunActions()
+            callbacks, self._domDoneCallbacks = self._domDoneCallbacks, []
+            for callback in callbacks:
+                callback()
         else:
             return self.onBridgeCmd(cmd)
 
@@ -1,10 +1,12 @@
+import json
+import math
 import os.path
 from nose.tools import assert_equals
 from mock import MagicMock
 from tempfile import TemporaryDirectory
 from zipfile import ZipFile
 
-from aqt.addons import AddonManager
+from aqt.addons import AddonManager, readableJson, parseConfigText
 
 
 def test_readMinimalManifest():
@@ -71,6 +73,91 @@ def test_conflictsMustBeStrings():
     )
 
 
+def test_modMustBeNumber():
+    assertReadManifest(
+        '{"package": "a", "name": "b", "mod": 1.5}',
+        {"package": "a", "name": "b", "mod": 1.5}
+    )
+    assertReadManifest(
+        '{"package": "a", "name": "b", "mod": "3"}',
+        {}
+    )
+    # as in json schema, booleans are not numbers
+    assertReadManifest(
+        '{"package": "a", "name": "b", "mod": true}',
+        {}
+    )
+
+
+def test_keysMustHaveTheirType():
+    assertReadManifest(
+        '{"package": "a", "name": 2}',
+        {}
+    )
+    assertReadManifest(
+        '{"package": ["a"], "name": "b"}',
+        {}
+    )
+    assertReadManifest(
+        '{"package": "a", "name": "b", "conflicts": "c"}',
+        {}
+    )
+    assertReadManifest(
+        '{"package": "a", "name": "b", "conflicts": []}',
+        {"package": "a", "name": "b", "conflicts": []}
+    )
+
+
+def test_manifestMustBeObject():
+    assertReadManifest(
+        '[{"package": "a", "name": "b"}]',
+        {}
+    )
+    assertReadManifest(
+        '"package"',
+        {}
+    )
+
+
+def test_readableJson():
+    # \n in strings becomes a new line
+    assert_equals(readableJson(r'{"a": "x\ny"}'), '{"a": "x\ny"}')
+    assert_equals(readableJson(r'{"k\ny": "t\tu\n"}'), '{"k\ny": "t\\tu\n"}')
+    # but not an escaped backslash followed by n
+    assert_equals(readableJson(r'{"a": "x\\ny"}'), r'{"a": "x\\ny"}')
+    assert_equals(readableJson(r'["\\", "\n"]'), '["\\\\", "\n"]')
+    # escaped quotes don't end the string
+    assert_equals(readableJson(r'{"a": "\"\n", "b": "\\\n"}'),
+                  '{"a": "\\"\n", "b": "\\\\\n"}')
+    text = '{"a": "no newline", "b": [1, 2]}'
+    assert_equals(readableJson(text), text)
+
+
+def test_readableJsonRoundTrip():
+    conf = {"a": "x\ny\\n", "b\n": ['"\n"', "\\\\"], "c": {"d": "\t\n"}}
+    text = readableJson(json.dumps(conf, sort_keys=True, indent=4))
+    assert_equals(parseConfigText(text), conf)
+
+
+def test_metaRoundTrip():
+    # meta.json written by json.dump may hold values outside strict JSON
+    meta = {"mod": 2**70, "config": {"ratio": float("nan")}}
+    with TemporaryDirectory() as td:
+        mw = MagicMock()
+        mw.pm.addonFolder.return_value = td
+        adm = AddonManager(mw)
+        os.mkdir(os.path.join(td, "123"))
+        adm.writeAddonMeta("123", meta)
+        read = adm.addonMeta("123")
+        assert_equals(read["mod"], 2**70)
+        assert isinstance(read["mod"], int)
+        assert math.isnan(read["config"]["ratio"])
+        # written back unchanged, not as an empty dict
+        adm.writeAddonMeta("123", read)
+        with open(os.path.join(td, "123", "meta.json")) as f:
+            assert_equals(f.read(), json.dumps(meta))
+
+
 def assertReadManifest(contents, expectedManifest, nameInZip="manifest.json"):
     with TemporaryDirectory() as td:
         zfn = os.path.join(td, "addon.zip")
@@ -548,6 +548,89 @@ def test_suspend():
     assert c.due == 1
     assert c.did == 1
 
+def test_suspendManyCards():
+    d = getEmptyCol()
+    cids = []
+    for i in range(3):
+        f = d.newNote()
+        f['Front'] = str(i)
+        d.addNote(f)
+        cids.append(f.cards()[0].id)
+    # ids are updated a few hundred at a time; spread the cards over
+    # several chunks
+    ids = [cids[0]] + list(range(1, 600)) + [cids[1]] + \
+        list(range(600, 1100)) + [cids[2]]
+    d.sched.suspendCards(ids)
+    assert [d.getCard(cid).queue for cid in cids] == [-1, -1, -1]
+    d.sched.unsuspendCards(ids)
+    assert [d.getCard(cid).queue for cid in cids] == [0, 0, 0]
+    d.sched.buryCards(ids)
+    assert all(d.getCard(cid).queue < -1 for cid in cids)
+
+def test_unburyLogsIds():
+    import anki.bothSched
+    haveReturning = anki.bothSched._haveReturning
+    # the ids are logged with update ... returning when sqlite has it,
+    # and by a select before the update otherwise
+    for returning in {False, haveReturning}:
+        d = getEmptyCol()
+        cids = []
+        for i in range(2):
+            f = d.newNote()
+            f['Front'] = str(i)
+            d.addNote(f)
+            cids.append(f.cards()[0].id)
+        d.sched.buryCards([cids[0]])
+        logged = []
+        d._debugLog = True
+        d.log = lambda *args, **kwargs: logged.append(args)
+        anki.bothSched._haveReturning = returning
+        try:
+            d.sched.unburyCards()
+        finally:
+            anki.bothSched._haveReturning = haveReturning
+        assert logged == [([cids[0]],)]
+        assert [d.getCard(cid).queue for cid in cids] == [0, 0]
+
+def test_burySiblingsReturning():
+    import anki.bothSched
+    haveReturning = anki.bothSched._haveReturning
+    results = []
+    # siblings are found by update ... returning when sqlite has it, and
+    # by a select before the update otherwise
+    for returning in (False, haveReturning):
+        d = getEmptyCol()
+        conf = d.decks.confForDid(1)
+        conf['new']['bury'] = True
+        conf['rev']['bury'] = True
+        d.models.setCurrent(d.models.byName("Cloze"))
+        f = d.newNote()
+        f['Text'] = "{{c1::a}} {{c2::b}} {{c3::c}} {{c4::d}}"
+        d.addNote(f)
+        c1, c2, c3, c4 = f.cards()
+        # a review due today, a new card, and a review due tomorrow
+        for c, due in ((c2, d.sched.today), (c4, d.sched.today + 1)):
+            c.type = c.queue = 2
+            c.ivl = 1
+            c.due = due
+            c.flush()
+        d.reset()
+        d.sched._fillNew()
+        d.sched._fillRev()
+        anki.bothSched._haveReturning = returning
+        try:
+            d.sched._burySiblings(d.getCard(c1.id))
+        finally:
+            anki.bothSched._haveReturning = haveReturning
+        cids = [c.id for c in (c1, c2, c3, c4)]
+        results.append((
+            [d.getCard(cid).queue for cid in cids],
+            # as indexes, since ids differ between the collections
+            sorted(cids.index(cid) for cid in d.sched._newQueue),
+            sorted(cids.index(cid) for cid in d.sched._revQueue)))
+    assert results[0] == results[1]
+    assert results[0] == ([0, -2, -2, 2], [0], [])
+
 def test_cram():
     d = getEmptyCol()
     f = d.newNote()
@@ -985,6 +1068,52 @@ def test_deckTree():
     names.remove("new")
     assert "new" not in names
 
+def test_deckTreeNested():
+    d = getEmptyCol()
+    a = d.decks.id("a")
+    ab = d.decks.id("a::b")
+    abc = d.decks.id("a::b::c")
+    ab2 = d.decks.id("a::b2")
+    tree = d.sched._groupChildren([
+        ["a::b2", ab2, 4, 5, 6],
+        ["a::b::c", abc, 1, 2, 3],
+        ["Default", 1, 0, 0, 0],
+        ["a", a, 1, 0, 0],
+        ["a::b", ab, 1, 1, 1],
+    ])
+    # children's counts are added to their parents'
+    assert tree == (
+        ("Default", 1, 0, 0, 0, ()),
+        ("a", a, 7, 8, 10, (
+            ("b", ab, 2, 3, 4, (
+                ("c", abc, 1, 2, 3, ()),
+            )),
+            ("b2", ab2, 4, 5, 6, ()),
+        )),
+    )
+
+def test_deckTreeMissingParent():
+    d = getEmptyCol()
+    # only check the grouping, not the deck limits
+    d.sched._groupChildrenNode = lambda *node: node
+    tree = d.sched._groupChildren([
+        ["x::y::z", 7, 1, 2, 3],
+        ["x::w", 8, 1, 1, 1],
+        ["v::u", 9, 0, 0, 1],
+    ])
+    # parents which are not in the list get a node without deck
+    assert tree == (
+        ("v", None, 0, 0, 0, (
+            ("u", 9, 0, 0, 1, ()),
+        )),
+        ("x", None, 0, 0, 0, (
+            ("w", 8, 1, 1, 1, ()),
+            ("y", None, 0, 0, 0, (
+                ("z", 7, 1, 2, 3, ()),
+            )),
+        )),
+    )
+
 def test_deckFlow():
     d = getEmptyCol()
     # add a note with default deck
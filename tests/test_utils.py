@@ -1,7 +1,48 @@
 # coding: utf-8
 
-from anki.utils import fmtTimeSpan
+import os
+from tempfile import TemporaryDirectory
+
+from anki.db import DB
+from anki.utils import fmtTimeSpan, chunkedIds
 
 def test_fmtTimeSpan():
     assert fmtTimeSpan(5) == "5 seconds"
     assert fmtTimeSpan(5, inTime=True) == "in 5 seconds"
+
+def test_chunkedIds():
+    assert list(chunkedIds([])) == []
+    assert list(chunkedIds([1, 2, 3], 3)) == [[1, 2, 3]]
+    assert list(chunkedIds([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+    ids = list(range(1201))
+    chunks = list(chunkedIds(ids))
+    assert [len(chunk) for chunk in chunks] == [500, 500, 201]
+    assert sum(chunks, []) == ids
+
+def test_transaction():
+    with TemporaryDirectory() as td:
+        path = os.path.join(td, "test.db")
+        db = DB(path)
+        db.execute("create table t (x int)")
+        db.commit()
+        # committed on exit
+        with db.transaction():
+            db.execute("insert into t values (1)")
+        other = DB(path)
+        assert other.list("select x from t") == [1]
+        other.close()
+        # rolled back on error
+        try:
+            with db.transaction():
+                db.execute("insert into t values (2)")
+                raise ValueError
+        except ValueError:
+            pass
+        assert db.list("select x from t") == [1]
+        # inside an open transaction, committing is left to its owner
+        db.execute("insert into t values (3)")
+        with db.transaction():
+            db.execute("insert into t values (4)")
+        db.rollback()
+        assert db.list("select x from t") == [1]
+        db.close()